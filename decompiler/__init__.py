@@ -24,7 +24,7 @@ from .util import DecompilerBase, First, WordConcatenator, reconstruct_paraminfo
 from .renpycompat import renpy
 
 from operator import itemgetter
-from io import StringIO
+from time import perf_counter
 
 from . import sl2decompiler
 from . import testcasedecompiler
@@ -32,7 +32,7 @@ from . import atldecompiler
 from . import astdump
 
 __all__ = ["astdump", "magic", "sl2decompiler", "testcasedecompiler", "translate", "util",
-           "Options", "pprint", "Decompiler", "renpycompat"]
+           "Options", "pprint", "split", "pprint_part", "stitch", "Decompiler", "renpycompat"]
 
 # Main API
 
@@ -40,7 +40,7 @@ __all__ = ["astdump", "magic", "sl2decompiler", "testcasedecompiler", "translate
 class Options(OptionBase):
     def __init__(self, indentation="    ", log=None,
                  translator=None, init_offset=False,
-                 sl_custom_names=None):
+                 sl_custom_names=None, timings=None):
         super(Options, self).__init__(indentation=indentation, log=log)
 
         # decompilation options
@@ -48,9 +48,50 @@ class Options(OptionBase):
         self.init_offset = init_offset
         self.sl_custom_names = sl_custom_names
 
+        # seconds spent in distinct phases of decompilation, by name of the phase
+        self.timings = {} if timings is None else timings
+
 def pprint(out_file, ast, options=Options()):
     Decompiler(out_file, options).dump(ast)
 
+# Decompiling a file in parts. split() translates the ast if needed and picks where to split it,
+# after which every part can be decompiled separately (or in separate processes) by pprint_part,
+# and stitch() puts their output back together. As the decompiler carries some state from one
+# statement to the next, every part starts from a prediction of that state. If a prediction
+# turns out to be wrong, stitch() returns None and the file has to be decompiled in one piece.
+
+def split(ast, parts, options=Options()):
+    """
+    Returns the indices of the top-level statements of `ast` that each part starts at, followed
+    by len(ast). There can be fewer than `parts` parts if there aren't enough places to split at.
+    """
+    return Decompiler(None, options).split(ast, parts)
+
+def pprint_part(out_file, ast, start, end, options=Options()):
+    """
+    Decompiles the top-level statements ast[start:end] of an ast that was passed to split().
+    Returns a tuple of the predicted state at the start of the part, and the state at its end.
+    """
+    return Decompiler(out_file, options).dump_part(ast, start, end)
+
+def stitch(parts):
+    """
+    Puts the output of parts back together. `parts` is a list of (output, start state, end state)
+    tuples for all parts in order. Returns None if the output would differ from decompiling the
+    file in one piece.
+    """
+    output = [parts[0][0]]
+    for (_, _, end), (part_output, start, _) in zip(parts, parts[1:]):
+        end_linenumber, end_init_offset, end_seen_label, clean = end
+        start_linenumber, start_init_offset, start_seen_label, _ = start
+        if (not clean or end_init_offset != start_init_offset
+                or end_seen_label != start_seen_label or end_linenumber > start_linenumber):
+            return None
+        # these blank lines would have been written while advancing to the first statement
+        output.append("\n" * (start_linenumber - end_linenumber))
+        output.append(part_output)
+    return "".join(output)
+
 # Implementation
 
 class Decompiler(DecompilerBase):
@@ -75,6 +116,9 @@ class Decompiler(DecompilerBase):
         self.last_lines_behind = 0
         self.seen_label = False
         self.rpy_directive_arguments = []
+        # Maps the ids of the classes of the nodes we've seen to their node records. As the ast
+        # we're decompiling keeps its classes alive, these ids can't be reused while we need them.
+        self.node_records = {}
 
     def advance_to_line(self, linenumber):
         self.last_lines_behind = max(
@@ -85,7 +129,7 @@ class Decompiler(DecompilerBase):
     def save_state(self):
         return (super(Decompiler, self).save_state(), self.paired_with, self.say_inside_menu,
                 self.label_inside_menu, self.in_init, self.missing_init, self.most_lines_behind,
-                self.last_lines_behind, self.seen_label, self.rpy_directive_arguments)
+                self.last_lines_behind, self.seen_label, self.rpy_directive_arguments[:])
 
     def commit_state(self, state):
         super(Decompiler, self).commit_state(state[0])
@@ -99,39 +143,146 @@ class Decompiler(DecompilerBase):
         self.most_lines_behind = state[6]
         self.last_lines_behind = state[7]
         self.seen_label = state[8]
-        self.rpy_directive_arguments = state[9]
+        self.rpy_directive_arguments = state[9][:]
         super(Decompiler, self).rollback_state(state[0])
 
     def dump(self, ast):
-        if self.options.translator:
-            self.options.translator.translate_dialogue(ast)
+        self.translate(ast)
 
         if self.options.init_offset and isinstance(ast, (tuple, list)):
             self.set_best_init_offset(ast)
 
         # skip_indent_until_write avoids an initial blank line
         super(Decompiler, self).dump(ast, skip_indent_until_write=True)
+        self.finish()
+
+    def translate(self, ast):
+        if self.options.translator:
+            start = perf_counter()
+            self.options.translator.translate_dialogue(ast)
+            self.options.timings["translate"] = (
+                self.options.timings.get("translate", 0.0) + perf_counter() - start)
+
+    def finish(self):
         # if there's anything we wanted to write out but didn't yet, do it now
         for m in self.blank_line_queue:
             m(None)
         self.write("\n# Decompiled by unrpyc: https://github.com/CensoredUsername/unrpyc\n")
+        self.flush()
         assert not self.missing_init, "A required init, init label, or translate block was missing"
 
-    def print_node(self, ast):
-        # if this is a say node that appears in a menu, we need to not advance to it and skip it
-        if isinstance(ast, renpy.ast.Say):
-            if self.handle_say_possibly_inside_menu(ast):
-                return
+    def can_split_before(self, ast, index):
+        """
+        Returns whether the output of the top-level statements before ast[index] doesn't depend
+        on the statements after it, and the other way around, as long as the state predicted by
+        dump_part is right. That's the case for statements which start by advancing to their
+        line, and which don't have a preceding statement that looks ahead at them.
+        """
+        node = ast[index]
+        if not hasattr(node, 'linenumber'):
+            return False
 
+        cls = type(node)
+        record = self.node_records.get(id(cls))
+        if record is None:
+            record = self.node_record(cls)
+        _, is_say, advance = record
+        if is_say or not (advance or isinstance(node, renpy.ast.Label)):
+            return False
+
+        return not isinstance(ast[index - 1], (renpy.ast.Say, renpy.ast.Label, renpy.ast.Call,
+                                               renpy.ast.With, renpy.ast.RPY))
+
+    def split(self, ast, parts):
+        self.translate(ast)
+
+        if not isinstance(ast, (tuple, list)):
+            return [0, 1]
+
+        # The amount of statements is a good enough measure of the work in a part.
+        boundaries = [0]
+        for part in range(1, parts):
+            index = max(len(ast) * part // parts, boundaries[-1] + 1)
+            while index < len(ast) and not self.can_split_before(ast, index):
+                index += 1
+            if index >= len(ast):
+                break
+            boundaries.append(index)
+        boundaries.append(len(ast))
+        return boundaries
+
+    def part_state(self):
+        # whether nothing is carried over to the next statement, except for what's returned
+        clean = not (self.blank_line_queue or self.skip_indent_until_write or self.paired_with
+                     or self.say_inside_menu or self.label_inside_menu or self.in_init
+                     or self.missing_init or self.rpy_directive_arguments)
+        return (self.linenumber, self.init_offset, self.seen_label, clean)
+
+    def dump_part(self, ast, start, end):
+        if not isinstance(ast, (tuple, list)):
+            ast = [ast]
+
+        if start == 0:
+            if self.options.init_offset:
+                self.set_best_init_offset(ast)
+            self.linenumber = 1
+            self.skip_indent_until_write = True
+        else:
+            # Predict the state at the end of the previous part. Any blank lines between them
+            # are added when stitching, and the init offset is assumed to have been set.
+            self.linenumber = ast[start].linenumber - 1
+            if self.options.init_offset:
+                self.init_offset = self.best_init_offset(ast) or 0
+            self.seen_label = any(isinstance(node, renpy.ast.Label) for node in ast[:start])
+        start_state = self.part_state()
+
+        # the statements around this part still need to be visible to the ones inside it
+        self.block_stack.append(ast)
+        self.index_stack.append(start)
+        for i in range(start, end):
+            self.index_stack[-1] = i
+            self.print_node(ast[i])
+        self.block_stack.pop()
+        self.index_stack.pop()
+
+        if end == len(ast):
+            self.finish()
+        else:
+            self.flush()
+        return start_state, self.part_state()
+
+    def node_record(self, cls):
+        """
+        Determines how print_node should handle nodes of class `cls`. Returns a tuple of the
+        method to print the node with, whether it's a say node and whether we should advance to
+        its line number before printing it. As the fake classes do their instance checks in
+        python, this is only done once per class.
+        """
+        handler = self.dispatch.get(cls, type(self).print_unknown)
+        is_say = issubclass(cls, renpy.ast.Say)
         # We special-case line advancement for some types in their print
         # methods, so don't advance lines for them here.
-        if hasattr(ast, 'linenumber') and not isinstance(
-                ast, (renpy.ast.TranslateString, renpy.ast.With, renpy.ast.Label,
-                      renpy.ast.Pass, renpy.ast.Return)
-                ):
+        advance = not issubclass(
+            cls, (renpy.ast.TranslateString, renpy.ast.With, renpy.ast.Label,
+                  renpy.ast.Pass, renpy.ast.Return))
+        record = self.node_records[id(cls)] = (handler, is_say, advance)
+        return record
+
+    def print_node(self, ast):
+        cls = type(ast)
+        record = self.node_records.get(id(cls))
+        if record is None:
+            record = self.node_record(cls)
+        handler, is_say, advance = record
+
+        # if this is a say node that appears in a menu, we need to not advance to it and skip it
+        if is_say and self.handle_say_possibly_inside_menu(ast):
+            return
+
+        if advance and hasattr(ast, 'linenumber'):
             self.advance_to_line(ast.linenumber)
 
-        self.dispatch.get(type(ast), type(self).print_unknown)(self, ast)
+        handler(self, ast)
 
     # ATL subdecompiler hook
 
@@ -347,10 +498,9 @@ class Decompiler(DecompilerBase):
         self.indent()
 
         # It's possible that we're an "init label", not a regular label. There's no way to know
-        # if we are until we parse our children, so temporarily redirect all of our output until
-        # that's done, so that we can squeeze in an "init " if we are.
-        out_file = self.out_file
-        self.out_file = StringIO()
+        # if we are until we parse our children, so remember where our output starts, so that we
+        # can squeeze in an "init " there if we are.
+        mark = self.out_file.mark()
         missing_init = self.missing_init
         self.missing_init = False
         try:
@@ -359,10 +509,8 @@ class Decompiler(DecompilerBase):
             self.print_nodes(ast.block, 1)
         finally:
             if self.missing_init:
-                out_file.write("init ")
+                self.out_file.insert(mark, "init ")
             self.missing_init = missing_init
-            out_file.write(self.out_file.getvalue())
-            self.out_file = out_file
 
     @dispatch(renpy.ast.Jump)
     def print_jump(self, ast):
@@ -467,6 +615,11 @@ class Decompiler(DecompilerBase):
             self.missing_init = True
 
     def set_best_init_offset(self, nodes):
+        offset = self.best_init_offset(nodes)
+        if offset is not None:
+            self.set_init_offset(offset)
+
+    def best_init_offset(self, nodes):
         votes = {}
         for ast in nodes:
             if not isinstance(ast, renpy.ast.Init):
@@ -486,7 +639,8 @@ class Decompiler(DecompilerBase):
             # It's only worth setting an init offset if it would save
             # more than one priority specification versus not setting one.
             if votes.get(0, 0) + 1 < votes[winner]:
-                self.set_init_offset(winner)
+                return winner
+        return None
 
     def set_init_offset(self, offset):
         def do_set_init_offset(linenumber):
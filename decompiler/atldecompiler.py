@@ -45,6 +45,7 @@ class ATLDecompiler(DecompilerBase):
         self.skip_indent_until_write = skip_indent_until_write
 
         self.print_block(ast)
+        self.flush()
 
         return self.linenumber
 
@@ -47,6 +47,7 @@ __all__ = [
     "FakeClassType", "FakeClassFactory",
     "FakeClass", "FakeStrict", "FakeWarning", "FakeIgnore",
     "FakeUnpicklingError", "FakeUnpickler", "SafeUnpickler",
+    "FastFakeUnpickler", "FastSafeUnpickler", "HAS_FAST_UNPICKLER",
     "SafePickler"
 ]
 
@@ -94,6 +95,26 @@ class FakeClassType(type):
         if "__module__" not in attributes:
             raise TypeError("No module has been specified for FakeClassType {0}".format(name))
 
+        # fake classes with __slots__ need their state to be set attribute by attribute.
+        # They can also give their slots default values, which would normally conflict with the
+        # slots themselves. These are set aside and filled in by __setstate__ instead.
+        slots = attributes.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        if slots:
+            defaults = {}
+            names = set(slots)
+            for base in reversed(bases):
+                defaults.update(getattr(base, "__slot_defaults__", {}))
+                names.update(getattr(base, "__slot_names__", ()))
+            for slot in slots:
+                if slot in attributes:
+                    defaults[slot] = attributes.pop(slot)
+            attributes["__slot_defaults__"] = defaults
+            attributes["__slot_names__"] = frozenset(names)
+            attributes["__state_shape__"] = None
+            attributes.setdefault("__setstate__", _slotted_setstate)
+
         # assemble instance
         return type.__new__(cls, name, bases, attributes)
 
@@ -103,6 +124,8 @@ class FakeClassType(type):
     # comparison logic
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not hasattr(other, "__name__"):
             return False
         if hasattr(other, "__module__"):
@@ -117,12 +140,33 @@ class FakeClassType(type):
         return hash(self.__module__ + "." + self.__name__)
 
     def __instancecheck__(self, instance):
-        return self.__subclasscheck__(instance.__class__)
+        entry = _subclass_checks.get((id(self), id(instance.__class__)))
+        if entry is not None:
+            return entry[2]
+        return _subclass_check(self, instance.__class__)
 
     def __subclasscheck__(self, subclass):
-        return (self == subclass or
-                (bool(subclass.__bases__) and
-                 any(self.__subclasscheck__(base) for base in subclass.__bases__)))
+        entry = _subclass_checks.get((id(self), id(subclass)))
+        if entry is not None:
+            return entry[2]
+        return _subclass_check(self, subclass)
+
+# The results of the subclass checks of fake classes and fake modules. As these compare names
+# instead of identities, every check would otherwise have to compare the names of the subclass
+# and all of its bases in python. The table is keyed by the ids of both classes involved, and
+# every entry holds on to them so these ids can't be reused for something else.
+_subclass_checks = {}
+
+def _subclass_check(cls, subclass):
+    """
+    Performs the subclass check of fake class or fake module *cls* on *subclass* the slow way,
+    and stores the result in the subclass check table.
+    """
+    result = (cls == subclass or
+              (bool(subclass.__bases__) and
+               any(issubclass(base, cls) for base in subclass.__bases__)))
+    _subclass_checks[(id(cls), id(subclass))] = (cls, subclass, result)
+    return result
 
 # PY2 doesn't like the PY3 way of metaclasses and PY3 doesn't support the PY2 way
 # so we call the metaclass directly
@@ -209,13 +253,92 @@ class FakeIgnore(FakeClass, object):
         if slotstate:
             self.__dict__.update(slotstate)
 
+def _slotted_setstate(self, state):
+    """
+    The :meth:`__setstate__` of fake classes with :attr:`__slots__`. It accepts the same state
+    as the :meth:`__setstate__` of :class:`FakeStrict`, :class:`FakeWarning` and
+    :class:`FakeIgnore`, but puts the attributes that have a declared slot in it. Anything else
+    goes in the instance dictionary, like it would have without slots. Afterwards, the defaults of
+    any slots that weren't set are filled in. State that can't be handled like this is passed on
+    to the :meth:`__setstate__` of the base class, which deals with it in its own way.
+
+    Pickled state tends to have the same shape for every instance of a class: the same
+    attributes, stored the same way. So after the first instance, the plan for setting its state
+    is reused for every instance with state of the same shape.
+    """
+    cls = type(self)
+    shape = cls.__state_shape__
+    if shape is not None:
+        kind, keys, plan = shape
+        if kind is dict:
+            if type(state) is dict and state.keys() == keys:
+                return _apply_state(self, state, plan)
+        elif (type(state) is tuple and len(state) == 2 and state[0] is None and
+              type(state[1]) is dict and state[1].keys() == keys):
+            return _apply_state(self, state[1], plan)
+
+    slotstate = None
+
+    if (isinstance(state, tuple) and len(state) == 2 and
+        (state[0] is None or isinstance(state[0], dict)) and
+        (state[1] is None or isinstance(state[1], dict))):
+        state, slotstate = state
+
+    if state and not isinstance(state, dict):
+        for base in cls.__mro__:
+            setstate = base.__dict__.get("__setstate__", _slotted_setstate)
+            if setstate is not _slotted_setstate:
+                return setstate(self, state)
+
+    if state and slotstate:
+        state = dict(state, **slotstate)
+        kind = None
+    elif slotstate:
+        state = slotstate
+        kind = tuple
+    else:
+        state = state or {}
+        kind = dict
+
+    plan = _state_plan(cls, state)
+    if cls.__state_shape__ is None and kind is not None:
+        cls.__state_shape__ = kind, frozenset(state), plan
+    _apply_state(self, state, plan)
+
+def _state_plan(cls, state):
+    """
+    Works out how to set *state* on an instance of the slotted fake class *cls*. Returns a tuple
+    of the keys that have a declared slot, the keys that go in the instance dictionary, and the
+    slots with a default value that are missing from *state*.
+    """
+    slots = cls.__slot_names__
+    return (tuple(key for key in state if key in slots),
+            tuple(key for key in state if key not in slots),
+            tuple(key for key in cls.__slot_defaults__ if key not in state))
+
+def _apply_state(self, state, plan):
+    """
+    Sets *state* on the instance *self* of a slotted fake class, following a plan made by
+    :func:`_state_plan`.
+    """
+    slotted, unslotted, missing = plan
+    for key in slotted:
+        setattr(self, key, state[key])
+    if unslotted:
+        instance_dict = self.__dict__
+        for key in unslotted:
+            instance_dict[key] = state[key]
+    defaults = type(self).__slot_defaults__
+    for key in missing:
+        setattr(self, key, defaults[key])
+
 class FakeClassFactory(object):
     """
     Factory of fake classes. It will create fake class definitions on demand
     based on the passed arguments.
     """
 
-    def __init__(self, special_cases=(), default_class=FakeStrict):
+    def __init__(self, special_cases=(), default_class=FakeStrict, slots=None):
         """
         *special_cases* should be an iterable containing fake classes which should be treated
         as special cases during the fake unpickling process. This way you can specify custom methods
@@ -238,12 +361,24 @@ class FakeClassFactory(object):
 
         Alternatively they can also be instantiated using :class:`FakeClassType` directly::
            special_cases = [FakeClassType(c.__name__, c.__bases__, c.__dict__, c.__module__)]
+
+        *slots* can be a mapping of ``(module, name)`` tuples to sequences of attribute names.
+        Classes generated for these get :attr:`__slots__` for these attributes, which stores their
+        instances considerably more compactly. Any other attributes are still stored in the
+        instance dictionary. Special cases can declare :attr:`__slots__` themselves.
         """
         self.special_cases = dict(((i.__module__, i.__name__), i) for i in special_cases)
         self.default = default_class
+        self.slots = dict(((module, name), tuple(names))
+                          for (module, name), names in (slots or {}).items())
 
         self.class_cache = {}
 
+    # The classes generated by all factories, keyed by their default class, module, name and slots.
+    # Sharing these between factories ensures that a module and name always map to the same
+    # class object within a process, however many factories and unpicklers are created.
+    interned_classes = {}
+
     def __call__(self, name, module):
         """
         Return the right class for the specified *module* and *name*.
@@ -251,7 +386,8 @@ class FakeClassFactory(object):
         This class will either be one of the special cases in case the name and module match,
         or a subclass of *default_class* will be created with the correct name and module.
 
-        Created class definitions are cached per factory instance.
+        Created class definitions are cached per factory instance. Classes that are generated
+        are also shared between all factories with the same *default_class* and *slots*.
         """
         # Check if we've got this class cached
         klass = self.class_cache.get((module, name), None)
@@ -261,12 +397,31 @@ class FakeClassFactory(object):
         klass = self.special_cases.get((module, name), None)
 
         if not klass:
-            # generate a new class def which inherits from the default fake class
-            klass = type(name, (self.default,), {"__module__": module})
+            # generate a new class def which inherits from the default fake class, unless
+            # another factory has done so already
+            slots = self.slots.get((module, name), ())
+            key = (self.default, module, name, slots)
+            klass = self.interned_classes.get(key, None)
+            if klass is None:
+                attributes = {"__module__": module}
+                if slots:
+                    attributes["__slots__"] = slots
+                klass = type(name, (self.default,), attributes)
+                klass = self.interned_classes.setdefault(key, klass)
 
         self.class_cache[(module, name)] = klass
         return klass
 
+    def reset(self):
+        """
+        Forget the classes generated by this factory, by all other factories and the results of
+        the subclass checks involving them. Every new module and name adds to these tables, so
+        long-running processes should call this between jobs to keep them from growing forever.
+        """
+        self.class_cache.clear()
+        self.interned_classes.clear()
+        _subclass_checks.clear()
+
 # Fake module implementation
 
 class FakeModule(types.ModuleType):
@@ -349,6 +504,8 @@ class FakeModule(types.ModuleType):
         del sys.modules[self.__name__]
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not hasattr(other, "__name__"):
             return False
         othername = other.__name__
@@ -363,13 +520,10 @@ class FakeModule(types.ModuleType):
     def __hash__(self):
         return hash(self.__name__)
 
-    def __instancecheck__(self, instance):
-        return self.__subclasscheck__(instance.__class__)
+    # These share the subclass check table of FakeClassType
+    __instancecheck__ = FakeClassType.__instancecheck__
 
-    def __subclasscheck__(self, subclass):
-        return (self == subclass or
-                (bool(subclass.__bases__) and
-                 any(self.__subclasscheck__(base) for base in subclass.__bases__)))
+    __subclasscheck__ = FakeClassType.__subclasscheck__
 
 class FakePackage(FakeModule):
     """
@@ -552,6 +706,53 @@ class SafeUnpickler(FakeUnpickler):
         else:
             return self.class_factory("extension_code_{0}".format(code), "copyreg")
 
+# In Python 3 pickle.Unpickler is the C implementation when it is available, which is
+# considerably faster than the pure python one FakeUnpickler has to inherit from to override
+# get_extension. The C implementation still lets us override find_class and persistent_load.
+HAS_FAST_UNPICKLER = PY3 and pickle.Unpickler is not pickle._Unpickler
+
+if HAS_FAST_UNPICKLER:
+    class FastFakeUnpickler(pickle.Unpickler):
+        """
+        A variant of :class:`FakeUnpickler` that is built on the C implementation of
+        :class:`pickle.Unpickler`. It takes the same arguments and produces the same results.
+        It is only available when :data:`HAS_FAST_UNPICKLER` is True.
+        """
+        def __init__(self, file, class_factory=None, encoding="bytes", errors="strict"):
+            super().__init__(file, fix_imports=False, encoding=encoding, errors=errors)
+            self.class_factory = class_factory or FakeClassFactory()
+
+        find_class = FakeUnpickler.find_class
+
+        def persistent_load(self, pid):
+            raise pickle.UnpicklingError("unsupported persistent id encountered")
+
+    class FastSafeUnpickler(FastFakeUnpickler):
+        """
+        A variant of :class:`SafeUnpickler` that is built on the C implementation of
+        :class:`pickle.Unpickler`. It takes the same arguments and offers the same safety
+        guarantees, as every class reference still passes through find_class.
+        It is only available when :data:`HAS_FAST_UNPICKLER` is True.
+
+        The C implementation always resolves extension codes through the extension registry
+        of :mod:`copyreg`, so with *use_copyreg* False a registered code results in a fake
+        class named after its registered module and name instead of ``extension_code_N``,
+        and an unregistered code raises :exc:`ValueError`.
+        """
+        def __init__(self, file, class_factory=None, safe_modules=(),
+                     use_copyreg=False, encoding="bytes", errors="strict"):
+            FastFakeUnpickler.__init__(self, file, class_factory,
+                                       encoding=encoding, errors=errors)
+            # A set of modules which are safe to load
+            self.safe_modules = set(safe_modules)
+            self.use_copyreg = use_copyreg
+
+        find_class = SafeUnpickler.find_class
+
+else:
+    FastFakeUnpickler = FakeUnpickler
+    FastSafeUnpickler = SafeUnpickler
+
 class SafePickler(pickle.Pickler if PY2 else pickle._Pickler):
     """
     A pickler which can repickle object hierarchies containing objects created by SafeUnpickler.
@@ -580,7 +781,7 @@ class SafePickler(pickle.Pickler if PY2 else pickle._Pickler):
 
 # the main API
 
-def load(file, class_factory=None, encoding="bytes", errors="errors"):
+def load(file, class_factory=None, encoding="bytes", errors="errors", fast=True):
     """
     Read a pickled object representation from the open binary :term:`file object` *file*
     and return the reconstituted object hierarchy specified therein, generating
@@ -597,20 +798,23 @@ def load(file, class_factory=None, encoding="bytes", errors="errors"):
     load them as bytes objects, otherwise it will attempt to decode them into unicode
     using the given *encoding* and *errors* arguments.
 
+    If *fast* is True, :class:`FastFakeUnpickler` is used instead when it is available.
+
     This function should only be used to unpickle trusted data.
     """
-    return FakeUnpickler(file, class_factory, encoding=encoding, errors=errors).load()
+    unpickler = FastFakeUnpickler if fast else FakeUnpickler
+    return unpickler(file, class_factory, encoding=encoding, errors=errors).load()
 
-def loads(string, class_factory=None, encoding="bytes", errors="errors"):
+def loads(string, class_factory=None, encoding="bytes", errors="errors", fast=True):
     """
     Similar to :func:`load`, but takes an 8-bit string (bytes in Python 3, str in Python 2)
     as its first argument instead of a binary :term:`file object`.
     """
-    return FakeUnpickler(StringIO(string), class_factory,
-                         encoding=encoding, errors=errors).load()
+    unpickler = FastFakeUnpickler if fast else FakeUnpickler
+    return unpickler(StringIO(string), class_factory, encoding=encoding, errors=errors).load()
 
 def safe_load(file, class_factory=None, safe_modules=(), use_copyreg=False,
-              encoding="bytes", errors="errors"):
+              encoding="bytes", errors="errors", fast=True):
     """
     Read a pickled object representation from the open binary :term:`file object` *file*
     and return the reconstituted object hierarchy specified therein, substituting any
@@ -633,20 +837,24 @@ def safe_load(file, class_factory=None, safe_modules=(), use_copyreg=False,
     load them as bytes objects, otherwise it will attempt to decode them into unicode
     using the given *encoding* and *errors* arguments.
 
+    If *fast* is True, :class:`FastSafeUnpickler` is used instead when it is available.
+
     This function can be used to unpickle untrusted data safely with the default
     class_factory when *safe_modules* is empty and *use_copyreg* is False.
     """
-    return SafeUnpickler(file, class_factory, safe_modules, use_copyreg,
-                         encoding=encoding, errors=errors).load()
+    unpickler = FastSafeUnpickler if fast else SafeUnpickler
+    return unpickler(file, class_factory, safe_modules, use_copyreg,
+                     encoding=encoding, errors=errors).load()
 
 def safe_loads(string, class_factory=None, safe_modules=(), use_copyreg=False,
-               encoding="bytes", errors="errors"):
+               encoding="bytes", errors="errors", fast=True):
     """
     Similar to :func:`safe_load`, but takes an 8-bit string (bytes in Python 3, str in Python 2)
     as its first argument instead of a binary :term:`file object`.
     """
-    return SafeUnpickler(StringIO(string), class_factory, safe_modules, use_copyreg,
-                         encoding=encoding, errors=errors).load()
+    unpickler = FastSafeUnpickler if fast else SafeUnpickler
+    return unpickler(StringIO(string), class_factory, safe_modules, use_copyreg,
+                     encoding=encoding, errors=errors).load()
 
 def safe_dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL):
     """
@@ -26,7 +26,9 @@ from . import magic
 magic.fake_package("renpy")
 import renpy  # noqa
 
+import codecs
 import pickletools
+import threading
 
 
 # these named classes need some special handling for us to be able to reconstruct ren'py ASTs from
@@ -66,6 +68,7 @@ SPECIAL_CLASSES.append(oldfrozenset)
 @SPECIAL_CLASSES.append
 class PyExpr(magic.FakeStrict, str):
     __module__ = "renpy.ast"
+    __slots__ = ("filename", "linenumber", "py")
 
     def __new__(cls, s, filename, linenumber, py=None):
         self = str.__new__(cls, s)
@@ -84,6 +87,7 @@ class PyExpr(magic.FakeStrict, str):
 @SPECIAL_CLASSES.append
 class PyExpr(magic.FakeStrict, str):
     __module__ = "renpy.astsupport"
+    __slots__ = ("filename", "linenumber", "py", "hashcode", "column")
 
     def __new__(cls, s, filename, linenumber, py=None, hashcode=None, column=None):
         self = str.__new__(cls, s)
@@ -104,6 +108,11 @@ class PyExpr(magic.FakeStrict, str):
 @SPECIAL_CLASSES.append
 class PyCode(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = ("source", "location", "mode", "py", "hashcode", "col_offset", "bytecode")
+
+    def __getstate__(self):
+        # the same format as ren'py uses, so __setstate__ can read it back
+        return (1, self.source, self.location, self.mode, self.py, self.hashcode, self.col_offset)
 
     def __setstate__(self, state):
         if len(state) == 4:
@@ -202,6 +211,49 @@ class RevertableSet(magic.FakeStrict, set):
             self.update(state)
 
 
+# Most nodes in a ren'py AST are instances of a handful of classes, so storing their attributes in
+# __slots__ instead of an instance dict saves a lot of memory on large games. Any attributes that
+# aren't listed still end up in the instance dict.
+
+# the attributes of every renpy.ast.Node
+NODE_SLOTS = ("filename", "linenumber", "name", "next", "statement_start")
+
+# slots for classes that don't need to be special cases otherwise
+FAKE_SLOTS = {
+    ("renpy.ast", "If"): NODE_SLOTS + ("entries",),
+    ("renpy.ast", "While"): NODE_SLOTS + ("condition", "block"),
+    ("renpy.ast", "Pass"): NODE_SLOTS,
+    ("renpy.ast", "Screen"): NODE_SLOTS + ("screen",),
+    ("renpy.sl2.slast", "SLScreen"): (
+        "location", "serial", "name", "parameters", "keyword", "children", "modal", "zorder",
+        "tag", "variant", "predict", "sensitive", "roll_forward", "layer", "analysis",
+        "prepared"),
+    ("renpy.sl2.slast", "SLDisplayable"): (
+        "location", "serial", "displayable", "scope", "child_or_fixed", "style",
+        "pass_context", "imagemap", "hotspot", "replaces", "default_keywords", "name",
+        "unique", "positional", "keyword", "children", "variable"),
+    ("renpy.sl2.slast", "SLBlock"): ("location", "serial", "keyword", "children"),
+    ("renpy.sl2.slast", "SLIf"): ("location", "serial", "entries"),
+    ("renpy.sl2.slast", "SLShowIf"): ("location", "serial", "entries"),
+    ("renpy.sl2.slast", "SLFor"): (
+        "location", "serial", "variable", "index_expression", "expression", "keyword",
+        "children"),
+    ("renpy.sl2.slast", "SLUse"): (
+        "location", "serial", "target", "args", "id", "block", "ast"),
+    ("renpy.sl2.slast", "SLPython"): ("location", "serial", "code"),
+    ("renpy.sl2.slast", "SLDefault"): ("location", "serial", "variable", "expression"),
+    ("renpy.atl", "RawBlock"): ("loc", "animation", "statements"),
+    ("renpy.atl", "RawMultipurpose"): (
+        "loc", "warper", "duration", "warp_function", "properties", "expressions", "splines",
+        "revolution", "circles"),
+    ("renpy.atl", "RawRepeat"): ("loc", "repeats"),
+    ("renpy.atl", "RawTime"): ("loc", "time"),
+    ("renpy.atl", "RawChoice"): ("loc", "choices"),
+    ("renpy.atl", "RawParallel"): ("loc", "blocks"),
+    ("renpy.atl", "RawOn"): ("loc", "handlers"),
+}
+
+
 # as of ren'py 8.4, default properties of many classes are not stored in the pickle anymore.
 # so we define prototypes of these classes here, so we don't end up with a soup of hasattr checks.
 # rules: unless otherwise stated, int properties default to 0, anything else is None
@@ -211,6 +263,9 @@ class RevertableSet(magic.FakeStrict, set):
 @SPECIAL_CLASSES.append
 class Say(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + (
+        "who", "who_fast", "what", "with_", "interact", "attributes", "arguments",
+        "temporary_attributes", "identifier", "explicit_identifier", "rollback")
 
     who = None
     with_ = None
@@ -225,6 +280,7 @@ class Say(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Init(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("block", "priority")
 
     priority = 0
 
@@ -232,12 +288,15 @@ class Init(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Label(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = ("filename", "linenumber", "next", "statement_start", "_name", "block",
+                 "parameters", "hide")
 
     translation_relevant = True
     parameters = None
     hide = False
 
-    # shenanigans have begotten shenanigans
+    # shenanigans have begotten shenanigans. Depending on the version, the name is stored as
+    # either name or _name. name has no slot, so it ends up in the instance dict.
     @property
     def name(self):
         if "name" in self.__dict__:
@@ -249,6 +308,7 @@ class Label(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Python(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("code", "hide", "store")
 
     store = "store"
     hide = False
@@ -257,6 +317,7 @@ class Python(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class EarlyPython(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("code", "hide", "store")
 
     store = "store"
     hide = False
@@ -265,6 +326,7 @@ class EarlyPython(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Image(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("imgname", "code", "atl")
 
     code = None
     atl = None
@@ -273,6 +335,7 @@ class Image(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Transform(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("varname", "parameters", "atl", "store")
 
     parameters = None
     store = "store"
@@ -281,6 +344,7 @@ class Transform(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Show(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("imspec", "atl", "warp")
 
     atl = None
     warp = True
@@ -289,6 +353,7 @@ class Show(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class ShowLayer(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("layer", "at_list", "atl", "warp")
 
     atl = None
     warp = True
@@ -298,6 +363,7 @@ class ShowLayer(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Camera(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("layer", "at_list", "atl", "warp")
 
     atl = None
     warp = True
@@ -307,6 +373,7 @@ class Camera(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Scene(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("imspec", "layer", "atl", "warp")
 
     imspec = None
     atl = None
@@ -317,6 +384,7 @@ class Scene(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Hide(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("imspec", "warp")
 
     warp = True
 
@@ -324,6 +392,7 @@ class Hide(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class With(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("expr", "paired")
 
     paired = None
 
@@ -331,6 +400,7 @@ class With(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Call(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("label", "arguments", "expression", "global_label")
 
     arguments = None
     expression = False
@@ -340,6 +410,7 @@ class Call(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Return(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("expression",)
 
     expression = None
 
@@ -347,6 +418,8 @@ class Return(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Menu(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + (
+        "items", "set", "with_", "has_caption", "arguments", "item_arguments", "rollback")
 
     translation_relevant = True
     set = None
@@ -360,6 +433,7 @@ class Menu(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Jump(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("target", "expression", "global_label")
 
     expression = False
     global_label = ""
@@ -368,6 +442,9 @@ class Jump(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class UserStatement(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + (
+        "line", "parsed", "block", "translatable", "code_block", "translation_relevant",
+        "rollback", "subparses", "init_priority", "atl")
 
     block = []
     translatable = False
@@ -382,6 +459,7 @@ class UserStatement(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Define(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("varname", "code", "store", "operator", "index")
 
     store = "store"
     operator = "="
@@ -391,6 +469,7 @@ class Define(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Default(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + ("varname", "code", "store")
 
     store = "store"
 
@@ -398,6 +477,8 @@ class Default(magic.FakeStrict):
 @SPECIAL_CLASSES.append
 class Style(magic.FakeStrict):
     __module__ = "renpy.ast"
+    __slots__ = NODE_SLOTS + (
+        "style_name", "parent", "properties", "clear", "take", "delattr", "variant")
 
     parent = None
     clear = False
@@ -478,12 +559,23 @@ class TranslateEarlyBlock(magic.FakeStrict):
 
 # end of the declarative data section
 
-CLASS_FACTORY = magic.FakeClassFactory(SPECIAL_CLASSES, magic.FakeStrict)
+CLASS_FACTORY = magic.FakeClassFactory(SPECIAL_CLASSES, magic.FakeStrict, FAKE_SLOTS)
 
 
-def pickle_safe_loads(buffer: bytes):
+def pickle_safe_loads(buffer: bytes, fast=True):
     return magic.safe_loads(
-        buffer, CLASS_FACTORY, {"collections"}, encoding="ASCII", errors="strict")
+        buffer, CLASS_FACTORY, {"collections"}, encoding="ASCII", errors="strict", fast=fast)
+
+
+def pickle_safe_load(infile, fast=True, detect_python2=False):
+    # with detect_python2, pickle_python2_detected() tells if this looked like a python 2 pickle.
+    encoding = "ASCII"
+    if detect_python2:
+        encoding = PYTHON2_DETECTING_ENCODING
+        _python2_detection.found = False
+
+    return magic.safe_load(
+        infile, CLASS_FACTORY, {"collections"}, encoding=encoding, errors="strict", fast=fast)
 
 
 def pickle_safe_dumps(buffer: bytes):
@@ -499,7 +591,8 @@ def pickle_loads(buffer: bytes):
     return magic.loads(buffer, CLASS_FACTORY)
 
 
-def pickle_detect_python2(buffer: bytes):
+def pickle_detect_python2(buffer):
+    # buffer can be a bytes-like object or a binary file object
     # When objects get pickled in protocol 2, python 2 will
     # normally emit BINSTRING/SHORT_BINSTRING opcodes for any attribute
     # names / binary strings.
@@ -528,3 +621,39 @@ def pickle_detect_python2(buffer: bytes):
             return True
 
     return False
+
+
+# Detecting python 2 pickles while loading them.
+# pickle_detect_python2 needs a separate pass over the entire pickle, in python. The unpickler
+# however already decodes every BINSTRING/SHORT_BINSTRING it encounters with the encoding it was
+# given. So we give it an encoding that is just ascii, but notes down that it was used. This works
+# for the C unpickler as well, as it simply looks up the codec by name.
+# The only difference with pickle_detect_python2 is that protocol 0/1 STRING opcodes also count,
+# which are just as much a sign of python 2.
+
+PYTHON2_DETECTING_ENCODING = "unrpyc_python2_detecting_ascii"
+
+# whether the current thread decoded any python 2 strings since the last reset
+_python2_detection = threading.local()
+
+
+def _python2_detecting_decode(data, errors="strict"):
+    _python2_detection.found = True
+    return codecs.ascii_decode(data, errors)
+
+
+def _python2_detecting_search(name):
+    if name != PYTHON2_DETECTING_ENCODING:
+        return None
+
+    return codecs.CodecInfo(
+        codecs.ascii_encode, _python2_detecting_decode, name=PYTHON2_DETECTING_ENCODING)
+
+
+codecs.register(_python2_detecting_search)
+
+
+def pickle_python2_detected():
+    # Whether the last pickle_safe_load with detect_python2 on this thread encountered python 2
+    # strings. If the load failed, this reports what was found up to that point.
+    return getattr(_python2_detection, "found", False)
@@ -158,3 +158,24 @@ class Translator:
             group = []
 
         children[:] = new_children
+
+
+def has_translatable_content(children):
+    """
+    Returns whether any node in the given block, or in any block nested in it, can be affected by
+    translations. Files without such content decompile the same with or without a translator.
+    """
+    for i in children:
+        if (isinstance(i, (renpy.ast.Say, renpy.ast.Menu))
+                or (hasattr(i, 'translatable') and i.translatable)):
+            return True
+
+        if isinstance(i, renpy.ast.If):
+            if any(has_translatable_content(block) for condition, block in i.entries):
+                return True
+
+        elif isinstance(getattr(i, 'block', None), list):
+            if has_translatable_content(i.block):
+                return True
+
+    return False
@@ -21,8 +21,8 @@
 
 import sys
 import re
-from io import StringIO
 from contextlib import contextmanager
+from functools import lru_cache
 
 
 class OptionBase:
@@ -31,14 +31,63 @@ class OptionBase:
         self.log = [] if log is None else log
 
 
+class OutputBuffer:
+    """
+    Collects the fragments of text written by decompilers in a list, and writes them to out_file
+    all at once when flushed. Decompilers for nested constructs are handed the buffer of their
+    parent, so their output ends up in the same place.
+    """
+    def __init__(self, out_file=None):
+        self.out_file = out_file
+        self.fragments = []
+
+    def write(self, string):
+        self.fragments.append(string)
+
+    def getvalue(self):
+        return "".join(self.fragments)
+
+    def mark(self):
+        """
+        Returns a position in the buffer that can later be passed to truncate() or insert().
+        Marks are only valid until the buffer is flushed.
+        """
+        return len(self.fragments)
+
+    def truncate(self, mark):
+        """
+        Throws away everything that was written after `mark`
+        """
+        del self.fragments[mark:]
+
+    def insert(self, mark, string):
+        """
+        Inserts `string` at `mark`, before everything that was written after it
+        """
+        self.fragments.insert(mark, string)
+
+    def flush(self):
+        if self.out_file is not None and self.fragments:
+            self.out_file.write(self.getvalue())
+            self.fragments.clear()
+
+
 class DecompilerBase:
     def __init__(self, out_file=None, options=OptionBase()):
-        # the file object that the decompiler outputs to
-        self.out_file = out_file or sys.stdout
+        # the buffer that the decompiler outputs to. If we were given a buffer, it belongs to
+        # another decompiler which will take care of flushing it.
+        if isinstance(out_file, OutputBuffer):
+            self.out_file = out_file
+            self.owns_out_file = False
+        else:
+            self.out_file = OutputBuffer(out_file or sys.stdout)
+            self.owns_out_file = True
         # Decompilation options
         self.options = options
         # the string we use for indentation
         self.indentation = options.indentation
+        # the strings that indent() writes, by indent level
+        self.indent_strings = []
 
 
         # properties used for keeping track of where we are
@@ -68,8 +117,16 @@ class DecompilerBase:
         if not isinstance(ast, (tuple, list)):
             ast = [ast]
         self.print_nodes(ast)
+        self.flush()
         return self.linenumber
 
+    def flush(self):
+        """
+        Writes everything that was written so far to the file given in the constructor
+        """
+        if self.owns_out_file:
+            self.out_file.flush()
+
     @contextmanager
     def increase_indent(self, amount=1):
         self.indent_level += amount
@@ -82,7 +139,8 @@ class DecompilerBase:
         """
         Shorthand method for writing `string` to the file
         """
-        string = str(string)
+        if not isinstance(string, str):
+            string = str(string)
         self.linenumber += string.count('\n')
         self.skip_indent_until_write = False
         self.out_file.write(string)
@@ -100,37 +158,41 @@ class DecompilerBase:
 
     def save_state(self):
         """
-        Save our current state.
+        Save our current state. Output written afterwards goes into the same buffer, so only
+        the position in it is remembered. The stacks are copied, as they're mutated in place.
         """
-        state = (self.out_file,
+        state = (self.out_file.mark(),
                  self.skip_indent_until_write,
                  self.linenumber,
-                 self.block_stack,
-                 self.index_stack,
+                 self.block_stack[:],
+                 self.index_stack[:],
                  self.indent_level,
-                 self.blank_line_queue)
-        self.out_file = StringIO()
+                 self.blank_line_queue[:])
         return state
 
     def commit_state(self, state):
         """
-        Commit changes since a saved state.
+        Commit changes since a saved state. As everything was written to the buffer already,
+        there's nothing left to do.
         """
-        out_file = state[0]
-        out_file.write(self.out_file.getvalue())
-        self.out_file = out_file
+        pass
 
     def rollback_state(self, state):
         """
         Roll back to a saved state.
         """
-        (self.out_file,
+        (mark,
          self.skip_indent_until_write,
          self.linenumber,
-         self.block_stack,
-         self.index_stack,
+         block_stack,
+         index_stack,
          self.indent_level,
-         self.blank_line_queue) = state
+         blank_line_queue) = state
+        self.out_file.truncate(mark)
+        # copy again, so the state can be rolled back to more than once
+        self.block_stack = block_stack[:]
+        self.index_stack = index_stack[:]
+        self.blank_line_queue = blank_line_queue[:]
 
     def advance_to_line(self, linenumber):
         # If there was anything that we wanted to do as soon as we found a blank line,
@@ -157,7 +219,12 @@ class DecompilerBase:
         calls the write method
         """
         if not self.skip_indent_until_write:
-            self.write('\n' + self.indentation * self.indent_level)
+            indent_strings = self.indent_strings
+            while len(indent_strings) <= self.indent_level:
+                indent_strings.append('\n' + self.indentation * len(indent_strings))
+
+            self.linenumber += 1
+            self.out_file.write(indent_strings[self.indent_level])
 
     def print_nodes(self, ast, extra_indent=0):
         # This node is a list of nodes
@@ -411,6 +478,26 @@ KEYWORDS = set(['$', 'as', 'at', 'behind', 'call', 'expression', 'hide',
 
 word_regexp = '[a-zA-Z_\u00a0-\ufffd][0-9a-zA-Z_\u00a0-\ufffd]*'
 
+# The patterns used by the Lexer. These are compiled once here, as looking them up in the cache of
+# the re module on every token attempt adds up quickly.
+whitespace_re = re.compile(r"(\s+|\\\n)+", re.DOTALL)
+string_re = re.compile(r"""(u?(?P<a>"(?:"")?|'(?:'')?).*?(?<=[^\\])(?:\\\\)*(?P=a))""", re.DOTALL)
+number_re = re.compile(r'(\+|\-)?(\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', re.DOTALL)
+word_re = re.compile(word_regexp, re.DOTALL)
+dot_re = re.compile(r'\.', re.DOTALL)
+comment_re = re.compile("[^\n]*", re.DOTALL)
+token_re = re.compile(r'\w+| +|.', re.DOTALL)
+
+# A name, possibly followed by attribute accesses. These are always simple expressions, unless one
+# of the words is a keyword.
+dotted_name_re = re.compile(rf'{word_regexp}(?:\.{word_regexp})*')
+
+# simple_expression_guard gets called with the same few strings over and over again (character
+# names, common transitions, etc.), so its results are remembered. The cache is shared by
+# everything decompiled in this process.
+EXPRESSION_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
 def simple_expression_guard(s):
     # Some things we deal with are supposed to be parsed by
     # ren'py's Lexer.simple_expression but actually cannot
@@ -420,6 +507,10 @@ def simple_expression_guard(s):
     # but we're not naive
     s = s.strip()
 
+    # fast path for the common case of a plain (dotted) name
+    if dotted_name_re.fullmatch(s) and KEYWORDS.isdisjoint(s.split(".")):
+        return s
+
     if Lexer(s).simple_expression():
         return s
     else:
@@ -428,6 +519,12 @@ def simple_expression_guard(s):
 def split_logical_lines(s):
     return Lexer(s).split_logical_lines()
 
+def expression_cache_info():
+    # returns a dict of function name -> (hits, misses) of the expression caches
+    return {
+        "simple_expression_guard": simple_expression_guard.cache_info()[:2],
+    }
+
 class Lexer:
     # special lexer for simple_expressions the ren'py way
     # false negatives aren't dangerous. but false positives are
@@ -439,10 +536,14 @@ class Lexer:
     def re(self, regexp):
         # see if regexp matches at self.string[self.pos].
         # if it does, increment self.pos
+        # regexp should be a compiled pattern, strings are compiled with re.DOTALL.
         if self.length == self.pos:
             return None
 
-        match = re.compile(regexp, re.DOTALL).match(self.string, self.pos)
+        if isinstance(regexp, str):
+            regexp = re.compile(regexp, re.DOTALL)
+
+        match = regexp.match(self.string, self.pos)
         if not match:
             return None
 
@@ -451,12 +552,12 @@ class Lexer:
 
     def eol(self):
         # eat the next whitespace and check for the end of this simple_expression
-        self.re(r"(\s+|\\\n)+")
+        self.re(whitespace_re)
         return self.pos >= self.length
 
     def match(self, regexp):
         # strip whitespace and match regexp
-        self.re(r"(\s+|\\\n)+")
+        self.re(whitespace_re)
         return self.re(regexp)
 
     def python_string(self, clear_whitespace=True):
@@ -464,9 +565,9 @@ class Lexer:
         # edit: now parses docstrings correctly. There was a degenerate case where
         # '''string'string''' would result in issues
         if clear_whitespace:
-            return self.match(r"""(u?(?P<a>"(?:"")?|'(?:'')?).*?(?<=[^\\])(?:\\\\)*(?P=a))""")
+            return self.match(string_re)
         else:
-            return self.re(r"""(u?(?P<a>"(?:"")?|'(?:'')?).*?(?<=[^\\])(?:\\\\)*(?P=a))""")
+            return self.re(string_re)
 
 
     def container(self):
@@ -496,11 +597,11 @@ class Lexer:
 
     def number(self):
         # parses a number, float or int (but not forced long)
-        return self.match(r'(\+|\-)?(\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+        return self.match(number_re)
 
     def word(self):
         # parses a word
-        return self.match(word_regexp)
+        return self.match(word_re)
 
     def name(self):
         # parses a word unless it's in KEYWORDS.
@@ -528,7 +629,7 @@ class Lexer:
         while not self.eol():
 
             # if the previous was followed by a dot, there should be a word after it
-            if self.match(r'\.'):
+            if self.match(dot_re):
                 if not self.name():
                     # ren'py errors here. I just stop caring
                     return False
@@ -577,13 +678,13 @@ class Lexer:
                 continue
 
             if c == '#':
-                self.re("[^\n]*")
+                self.re(comment_re)
                 continue
 
             if self.python_string(False):
                 continue
 
-            self.re(r'\w+| +|.')  # consume a word, whitespace or one symbol
+            self.re(token_re)  # consume a word, whitespace or one symbol
 
         if self.pos != startpos:
             lines.append(self.string[startpos:])
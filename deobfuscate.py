@@ -36,6 +36,7 @@ import base64
 import struct
 import zlib
 from collections import Counter
+from io import BytesIO
 
 from decompiler.renpycompat import pickle_safe_loads
 
@@ -279,6 +280,10 @@ def assert_is_normal_rpyc(f):
 def read_ast(f, context):
     diagnosis = ["Attempting to deobfuscate file:"]
 
+    # Every extractor reads the entire file, so only read it from disk once.
+    f.seek(0)
+    f = BytesIO(f.read())
+
     raw_datas = set()
 
     for extractor in EXTRACTORS:
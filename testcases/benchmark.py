@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 CensoredUsername
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Measures the performance of unrpyc on the corpora in `compiled`, or on the files given on the
+# command line. Decompiling a file is split up in the following phases, which are timed separately:
+#
+#   read:      reading the file and inflating the AST blob inside it
+#   unpickle:  unpickling the AST blob
+#   decompile: decompiling the AST to a string
+#   write:     writing that string to a file
+#
+# Throughput is reported in MiB of the data each phase consumes: the rpyc file for read, the
+# inflated blob for unpickle and the decompiled output for decompile and write.
+#
+# The results can be saved as a baseline with --save and compared to one with --baseline.
+# --scale builds larger inputs by repeating the statements of every file, to test how things
+# scale with file size.
+#
+# With --lexer, the expression lexer used by the decompiler is benchmarked instead, by running
+# simple_expression_guard and split_logical_lines on every python expression in the files.
+# simple_expression_guard is measured both without its cache, and with a cache that starts out
+# empty like it does when decompiling, in which case the cache hits and misses are reported too.
+#
+# With --isinstance, instance checks against the fake classes of the renpy.ast tree that the
+# decompiler checks nodes against are benchmarked, by checking every node in the files.
+
+from pathlib import Path
+from io import StringIO
+import argparse
+import glob
+import json
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+ROOT = Path(__file__).parent
+COMPILED = ROOT / "compiled"  # .rpyc files from compiling original
+
+sys.path.insert(0, str(ROOT.parent))
+
+import unrpyc
+import decompiler
+from decompiler import magic, util
+from decompiler.renpycompat import pickle_safe_loads, pickle_safe_dumps
+import renpy
+
+PHASES = ("read", "unpickle", "decompile", "write")
+# The lexer functions, by name. Those wrapped in an lru_cache are reported under the same name in
+# util.expression_cache_info
+LEXER_FUNCTIONS = {
+    "simple_expression_guard": util.simple_expression_guard,
+    "split_logical_lines": util.split_logical_lines,
+}
+# Node is included as a check that never succeeds, as fake classes don't inherit from it
+ISINSTANCE_CLASSES = ("Node", "Say", "Label", "With", "Pass", "Return", "TranslateString",
+                      "Init", "Menu")
+
+
+def build_rpyc(blob):
+    # Builds a rpyc v2 file containing just the given compressed AST blob in slot 1.
+    header = b"RENPY RPC2"
+    header += struct.pack("III", 1, len(header) + 2 * 12, len(blob))
+    header += struct.pack("III", 0, 0, 0)
+    return header + blob
+
+
+def scale_corpus(files, factor, destination):
+    # Writes a copy of every file to destination in which the statements are repeated `factor`
+    # times. Every repetition is unpickled separately, so they don't share any nodes when pickled
+    # again.
+    scaled = []
+    for file in files:
+        raw_contents = file.read_bytes()
+        contents, _ = unrpyc.read_rpyc_slot(raw_contents, unrpyc.Context())
+        contents = zlib.decompress(contents)
+
+        data, stmts = pickle_safe_loads(contents)
+        for _ in range(factor - 1):
+            stmts.extend(pickle_safe_loads(contents)[1])
+
+        scaled_file = destination / file.parent.name / file.name
+        scaled_file.parent.mkdir(parents=True, exist_ok=True)
+        scaled_file.write_bytes(build_rpyc(zlib.compress(pickle_safe_dumps((data, stmts)))))
+        scaled.append(scaled_file)
+
+    return scaled
+
+
+def run_phases(files, fast, output_dir):
+    # Runs every phase on every file once. Returns the seconds spent in and the bytes consumed by
+    # every phase.
+    seconds = dict.fromkeys(PHASES, 0.0)
+    sizes = dict.fromkeys(PHASES, 0)
+
+    for file in files:
+        start = time.perf_counter()
+        raw_contents = file.read_bytes()
+        contents, _ = unrpyc.read_rpyc_slot(raw_contents, unrpyc.Context())
+        contents = zlib.decompress(contents)
+        end = time.perf_counter()
+        seconds["read"] += end - start
+        sizes["read"] += len(raw_contents)
+
+        start = end
+        _, stmts = pickle_safe_loads(contents, fast)
+        end = time.perf_counter()
+        seconds["unpickle"] += end - start
+        sizes["unpickle"] += len(contents)
+
+        start = end
+        out_file = StringIO()
+        decompiler.pprint(out_file, stmts, decompiler.Options())
+        output = out_file.getvalue()
+        end = time.perf_counter()
+        seconds["decompile"] += end - start
+
+        start = end
+        out_filename = output_dir / f'{file.parent.name}-{file.stem}.rpy'
+        with out_filename.open('w', encoding='utf-8') as out_file:
+            out_file.write(output)
+        end = time.perf_counter()
+        seconds["write"] += end - start
+
+        encoded_size = len(output.encode('utf-8'))
+        sizes["decompile"] += encoded_size
+        sizes["write"] += encoded_size
+
+    return seconds, sizes
+
+
+def benchmark(files, fast, repeat):
+    # Returns the results for the given files, using the fastest of `repeat` runs for every phase.
+    best = dict.fromkeys(PHASES, None)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(repeat):
+            seconds, sizes = run_phases(files, fast, Path(output_dir))
+            for phase in PHASES:
+                if best[phase] is None or seconds[phase] < best[phase]:
+                    best[phase] = seconds[phase]
+
+    results = {}
+    for phase in PHASES:
+        elapsed = max(best[phase], 1e-9)
+        results[phase] = {
+            "seconds": best[phase],
+            "ops": len(files) / elapsed,
+            "mib_s": sizes[phase] / (1024 * 1024) / elapsed,
+        }
+    return results
+
+
+def attribute_values(item):
+    # Returns the values of all attributes of item, whether they are stored in its __dict__ or in
+    # the __slots__ of any class in its MRO.
+    values = list(vars(item).values()) if hasattr(item, "__dict__") else []
+    for cls in type(item).__mro__:
+        slots = cls.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for slot in slots:
+            if slot not in ("__dict__", "__weakref__") and hasattr(item, slot):
+                values.append(getattr(item, slot))
+    return values
+
+
+def walk_asts(files):
+    # Yields every object found anywhere in the ASTs of the given files once.
+    # everything is kept alive until the end, as seen relies on ids not being reused
+    asts = []
+    seen = set()
+    for file in files:
+        raw_contents = file.read_bytes()
+        contents, _ = unrpyc.read_rpyc_slot(raw_contents, unrpyc.Context())
+        asts.append(pickle_safe_loads(zlib.decompress(contents))[1])
+        stack = [asts[-1]]
+
+        while stack:
+            item = stack.pop()
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            yield item
+
+            if isinstance(item, (str, bytes)):
+                pass
+            elif isinstance(item, dict):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple, set)):
+                stack.extend(item)
+            else:
+                stack.extend(attribute_values(item))
+
+
+def collect_expressions(files):
+    # Returns all python expressions found anywhere in the ASTs of the given files.
+    return [str(i) for i in walk_asts(files) if isinstance(i, renpy.ast.PyExpr)]
+
+
+def collect_nodes(files):
+    # Returns all ren'py AST nodes found anywhere in the ASTs of the given files.
+    return [i for i in walk_asts(files)
+            if isinstance(i, magic.FakeClass) and type(i).__module__ == "renpy.ast"]
+
+
+def benchmark_lexer(files, repeat):
+    # Returns the results of the lexer functions on all expressions in the given files, using the
+    # fastest of `repeat` runs for every function. Functions with a cache are measured both
+    # without it, and with it cleared before every run.
+    expressions = collect_expressions(files)
+    size = sum(len(i.encode('utf-8')) for i in expressions)
+
+    results = {}
+    for name, function in LEXER_FUNCTIONS.items():
+        cached = function if hasattr(function, "cache_clear") else None
+        variants = [(name, function)]
+        if cached is not None:
+            variants = [(name, cached.__wrapped__), (f"{name} (cached)", cached)]
+
+        for label, function in variants:
+            best = None
+            for _ in range(repeat):
+                if cached is not None:
+                    cached.cache_clear()
+                start = time.perf_counter()
+                for expression in expressions:
+                    function(expression)
+                elapsed = time.perf_counter() - start
+
+                if best is None or elapsed < best:
+                    best = elapsed
+
+            elapsed = max(best, 1e-9)
+            results[label] = {
+                "seconds": best,
+                "ops": len(expressions) / elapsed,
+                "mib_s": size / (1024 * 1024) / elapsed,
+            }
+
+        # every run starts with an empty cache, so these are the same for all of them
+        if cached is not None:
+            hits, misses = util.expression_cache_info()[name]
+            results[f"{name} (cached)"].update(hits=hits, misses=misses)
+    return results
+
+
+def benchmark_isinstance(files, repeat):
+    # Returns the results of checking all nodes in the given files against the classes in
+    # ISINSTANCE_CLASSES, using the fastest of `repeat` runs for every class.
+    nodes = collect_nodes(files)
+
+    results = {}
+    for name in ISINSTANCE_CLASSES:
+        cls = getattr(renpy.ast, name)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for node in nodes:
+                isinstance(node, cls)
+            elapsed = time.perf_counter() - start
+
+            if best is None or elapsed < best:
+                best = elapsed
+
+        results[name] = {
+            "seconds": best,
+            "ops": len(nodes) / max(best, 1e-9),
+        }
+    return results
+
+
+def print_results(name, results, baseline=None, unit="files"):
+    # Prints the results of a corpus, and how they changed relative to baseline. Returns the
+    # largest slowdown in percent compared to the baseline.
+    print(f"{name}:")
+    worst = 0.0
+    width = max(len(phase) for phase in results)
+    for phase, result in results.items():
+        line = f"  {phase:>{width}}: {result['seconds']:8.4f} s {result['ops']:10.1f} {unit}/s"
+        if "mib_s" in result:
+            line += f" {result['mib_s']:8.2f} MiB/s"
+        if "hits" in result:
+            line += f" {result['hits']} hits {result['misses']} misses"
+
+        if baseline is not None and phase in baseline:
+            change = 100 * (result["seconds"] / max(baseline[phase]["seconds"], 1e-9) - 1)
+            worst = max(worst, change)
+            line += f"  ({change:+.1f}% time)"
+
+        print(line)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the phases of decompiling rpyc files with unrpyc")
+
+    parser.add_argument(
+        'file',
+        type=str,
+        nargs='*',
+        help="The rpyc files to benchmark with. Defaults to all files in 'compiled', in which "
+        "case every subfolder is reported as a separate corpus")
+
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type=int,
+        default=5,
+        help="How often to run every phase. The fastest run is reported")
+
+    parser.add_argument(
+        '--engine',
+        choices=["C", "python"],
+        default="C" if magic.HAS_FAST_UNPICKLER else "python",
+        help="The unpickling engine to use. Defaults to the C engine, if it is available")
+
+    parser.add_argument(
+        '--scale',
+        type=int,
+        default=1,
+        help="Benchmark with synthetic inputs that repeat the statements of every file this "
+        "many times")
+
+    parser.add_argument(
+        '--lexer',
+        action='store_true',
+        help="Benchmark the expression lexer on every python expression in the files, instead "
+        "of the phases of decompilation")
+
+    parser.add_argument(
+        '--isinstance',
+        action='store_true',
+        help="Benchmark instance checks of every node in the files against the fake classes "
+        "of renpy.ast, instead of the phases of decompilation")
+
+    parser.add_argument(
+        '--save',
+        type=Path,
+        help="Save the results as a baseline to this JSON file")
+
+    parser.add_argument(
+        '--baseline',
+        type=Path,
+        help="Compare the results to a baseline JSON file saved earlier")
+
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        help="Together with --baseline, exit with a failure status when any phase got slower "
+        "than this percentage")
+    args = parser.parse_args()
+
+    if args.engine == "C" and not magic.HAS_FAST_UNPICKLER:
+        parser.error("The C unpickler is not available.")
+
+    files = []
+    for file in args.file or [str(COMPILED / "**" / "*.rpyc")]:
+        files.extend(Path(i) for i in glob.iglob(file, recursive=True))
+
+    if not files:
+        print("Found no files to benchmark with.")
+        return
+
+    if args.lexer and args.isinstance:
+        parser.error("--lexer and --isinstance can't be used together.")
+    mode = "lexer" if args.lexer else "isinstance" if args.isinstance else "phases"
+
+    baseline = None
+    if args.baseline:
+        with args.baseline.open("r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        if baseline.get("mode", "phases") != mode:
+            parser.error(f"The baseline was not made with the same mode ({mode}).")
+        # the timings of a different engine or input size can't be compared with these
+        if baseline.get("engine", args.engine) != args.engine:
+            parser.error(f"The baseline was made with the {baseline['engine']} unpickler, not "
+                         f"the {args.engine} unpickler.")
+        if baseline.get("scale", 1) != args.scale:
+            parser.error(f"The baseline was made with inputs scaled {baseline['scale']} times, "
+                         f"not {args.scale} times.")
+
+    with tempfile.TemporaryDirectory() as scaled_dir:
+        if args.scale > 1:
+            print(f"Building inputs scaled {args.scale} times.")
+            files = scale_corpus(files, args.scale, Path(scaled_dir))
+
+        corpora = {}
+        for file in sorted(files):
+            corpora.setdefault(file.parent.name, []).append(file)
+        if len(corpora) > 1:
+            corpora["total"] = sorted(files)
+
+        if args.lexer:
+            print(f"Benchmarking the lexer on the expressions in {len(files)} files, "
+                  f"best of {args.repeat} runs.")
+        elif args.isinstance:
+            print(f"Benchmarking instance checks on the nodes in {len(files)} files, "
+                  f"best of {args.repeat} runs.")
+        else:
+            print(f"Benchmarking {len(files)} files with the {args.engine} unpickler, "
+                  f"best of {args.repeat} runs.")
+
+        results = {}
+        worst = 0.0
+        for name, corpus_files in corpora.items():
+            if args.lexer:
+                results[name] = benchmark_lexer(corpus_files, args.repeat)
+            elif args.isinstance:
+                results[name] = benchmark_isinstance(corpus_files, args.repeat)
+            else:
+                results[name] = benchmark(corpus_files, args.engine == "C", args.repeat)
+
+            corpus_baseline = None
+            if baseline is not None:
+                corpus_baseline = baseline["corpora"].get(name)
+            unit = "expressions" if args.lexer else "checks" if args.isinstance else "files"
+            worst = max(worst, print_results(name, results[name], corpus_baseline, unit))
+
+    peak_memory = unrpyc.peak_memory()
+    if peak_memory is not None:
+        print(f"Peak memory usage was {peak_memory / (1024 * 1024):.1f} MiB.")
+
+    if args.save:
+        with args.save.open("w", encoding="utf-8") as f:
+            json.dump({
+                "mode": mode,
+                "engine": args.engine,
+                "scale": args.scale,
+                "repeat": args.repeat,
+                "peak_memory": peak_memory,
+                "corpora": results,
+            }, f, indent=2)
+
+    if baseline is not None and args.threshold is not None and worst > args.threshold:
+        print(f"A measurement got {worst:.1f}% slower than the baseline, which exceeds the "
+              f"threshold of {args.threshold}%.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 CensoredUsername
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Packs files into a ren'py .rpa archive (RPA-3.0), to test reading script files straight out of
+# archives. Every file is stored under its path relative to the given directory.
+
+from pathlib import Path
+import argparse
+import pickle
+import random
+import zlib
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs files into a .rpa archive")
+    parser.add_argument("directory", type=Path, help="The directory with the files to pack")
+    parser.add_argument("archive", type=Path, help="The archive to create")
+    parser.add_argument("--key", type=lambda x: int(x, 0), default=None,
+                        help="The key to obfuscate the index with. Random by default")
+    args = parser.parse_args()
+
+    key = random.getrandbits(31) if args.key is None else args.key
+    files = sorted(x for x in args.directory.rglob("*") if x.is_file())
+
+    with args.archive.open("wb") as out_file:
+        # the header is rewritten once the offset of the index is known
+        out_file.write(b"RPA-3.0 %016x %08x\n" % (0, key))
+        index = {}
+        for path in files:
+            data = path.read_bytes()
+            index[path.relative_to(args.directory).as_posix()] = [
+                (out_file.tell() ^ key, len(data) ^ key, b"")]
+            out_file.write(data)
+
+        offset = out_file.tell()
+        out_file.write(zlib.compress(pickle.dumps(index, 2)))
+        out_file.seek(0)
+        out_file.write(b"RPA-3.0 %016x %08x\n" % (offset, key))
+
+    print(f"Packed {len(files)} files into {args.archive}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -27,13 +27,31 @@ __url__ = "https://github.com/CensoredUsername/unrpyc"
 
 
 import argparse
+import cProfile
 import glob
+import hashlib
+import json
+import mmap
+import os
 import struct
 import sys
+import tempfile
+import time
 import traceback
 import zlib
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from io import BufferedReader, BytesIO, RawIOBase, StringIO
 from pathlib import Path
 
+try:
+    # only available on unix-likes, it's used to report memory usage
+    import resource
+except ImportError:
+    resource = None
+
 try:
     # this script is often used in environments where multiprocessing is not available
     # or broken. So test if it's available, and then actually use it by creating a Lock
@@ -60,14 +78,21 @@ except ImportError:
         A minimal single-threaded mock of the multiprocessing.Pool class.
         """
 
-        def __init__(self, processes=None, initializer=None, initargs=None):
-            pass
+        def __init__(self, processes=None, initializer=None, initargs=()):
+            if initializer is not None:
+                initializer(*initargs)
+
+        def map(self, func, iterable, chunksize=None):
+            return list(map(func, iterable))
 
         def imap(self, func, iterable, chunksize=1):
             # In Python 3, the built-in map() returns a lazy iterator,
             # which is exactly what is needed to mimic pool.imap.
             return map(func, iterable)
 
+        def imap_unordered(self, func, iterable, chunksize=1):
+            return map(func, iterable)
+
         def close(self):
             pass
 
@@ -82,9 +107,13 @@ except ImportError:
 
 import decompiler
 import deobfuscate
+from unrpyc_tools import daemon
+from unrpyc_tools.archive import (ArchiveMember, BadArchiveException, MemoryReader,
+                                  archive_members, release_archives)
+from unrpyc_tools.bundle import OutputBundle
 from decompiler import astdump, translate
-from decompiler.renpycompat import (pickle_safe_loads, pickle_safe_dumps, pickle_loads,
-                                    pickle_detect_python2)
+from decompiler.renpycompat import (CLASS_FACTORY, pickle_safe_load, pickle_safe_dumps,
+                                    pickle_loads, pickle_python2_detected)
 
 
 class Context:
@@ -106,6 +135,28 @@ class Context:
         # return value from the worker, if any
         self.value = None
 
+        # context of decompiling the file, if this was already done while extracting translations
+        self.decompile_result = None
+
+        # time in seconds the worker spent on this file
+        self.elapsed = 0.0
+
+        # time in seconds spent in distinct phases of the work, by name of the phase
+        self.timings = {}
+
+        # number of occurrences of things worth reporting, such as cache hits, by name
+        self.counters = {}
+
+        # peak memory usage of the worker process in bytes after this file, if known
+        self.peak_memory = None
+
+        # outcome of the decompile cache lookup, if a cache was used
+        # options:
+        #     None:       no cache lookup was performed
+        #     hit:        the output was taken from the cache
+        #     miss:       the file was decompiled and its output stored in the cache
+        self.cache_status = None
+
     def log(self, message):
         self.log_contents.append(message)
 
@@ -118,6 +169,20 @@ class Context:
     def set_state(self, state):
         self.state = state
 
+    def add_timing(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(phase, time.perf_counter() - start)
+
 
 class BadRpycException(Exception):
     """Exception raised when we couldn't parse the rpyc archive format"""
@@ -126,72 +191,166 @@ class BadRpycException(Exception):
 
 # API
 
-def read_ast_from_file(in_file, context):
+def map_file(in_file):
+    """
+    Returns a read-only memoryview of the complete contents of the open binary file in_file.
+    Where possible the file is memory mapped, so slicing the view doesn't copy anything and only
+    the parts that are actually used get read. Otherwise, the file is simply read.
+    """
+    if isinstance(in_file, MemoryReader):
+        return in_file.view
+
+    try:
+        mapping = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # not a real file (e.g. BytesIO), an empty file, or something that can't be mapped
+        in_file.seek(0)
+        return memoryview(in_file.read())
+
+    # The mapping is closed once the last view of it is garbage collected. Closing it explicitly
+    # would fail while any slice of the view is still alive, e.g. in a traceback.
+    return memoryview(mapping)
+
+
+def read_rpyc_slot(raw_contents, context):
+    """
+    Locates the compressed AST blob inside the raw contents of a rpyc file.
+    Returns a tuple of (blob, is_rpyc_v1). raw_contents can be any bytes-like object, if it's a
+    memoryview the blob is a view into it as well.
+    """
     # Reads rpyc v1 or v2 file
     # v1 files are just a zlib compressed pickle blob containing some data and the ast
     # v2 files contain a basic archive structure that can be parsed to find the same blob
-    raw_contents = in_file.read()
-    file_start = raw_contents[:50]
-    is_rpyc_v1 = False
-
-    if not raw_contents.startswith(b"RENPY RPC2"):
+    if raw_contents[:10] != b"RENPY RPC2":
         # if the header isn't present, it should be a RPYC V1 file, which is just the blob
-        contents = raw_contents
-        is_rpyc_v1 = True
+        return raw_contents, True
 
-    else:
-        # parse the archive structure
-        position = 10
-        chunks = {}
-        have_errored = False
+    # parse the archive structure
+    position = 10
+    chunks = {}
+    have_errored = False
+
+    for expected_slot in range(1, 0xFFFFFFFF):
+        slot, start, length = struct.unpack("III", raw_contents[position: position + 12])
+
+        if slot == 0:
+            break
+
+        if slot != expected_slot and not have_errored:
+            have_errored = True
+
+            context.log(
+                "Warning: Encountered an unexpected slot structure. It is possible the \n"
+                "    file header structure has been changed.")
+
+        position += 12
+
+        chunks[slot] = raw_contents[start: start + length]
+
+    if 1 not in chunks:
+        context.set_state('bad_header')
+        raise BadRpycException(
+            "Unable to find the right slot to load from the rpyc file. The file header "
+            f"structure has been changed. File header: {bytes(raw_contents[:50])}")
+
+    return chunks[1], False
 
-        for expected_slot in range(1, 0xFFFFFFFF):
-            slot, start, length = struct.unpack("III", raw_contents[position: position + 12])
 
-            if slot == 0:
-                break
+class ZlibReader(RawIOBase):
+    """
+    A readable raw stream of the inflated contents of the zlib compressed bytes-like object data.
+    Data is only inflated as it is read, so the inflated contents never have to be in memory
+    completely. Like zlib.decompress, anything after the end of the compressed stream is ignored.
+    """
 
-            if slot != expected_slot and not have_errored:
-                have_errored = True
+    # amount of compressed data that is inflated at a time
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, data):
+        super().__init__()
+        self._data = memoryview(data)
+        self._position = 0
+        self._inflated = 0
+        self._decompressor = zlib.decompressobj()
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._inflated
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        while not self._decompressor.eof:
+            if self._decompressor.unconsumed_tail:
+                data = self._decompressor.unconsumed_tail
+            elif self._position < len(self._data):
+                data = self._data[self._position:self._position + self.CHUNK_SIZE]
+                self._position += len(data)
+            else:
+                raise zlib.error(
+                    "Error -5 while decompressing data: incomplete or truncated stream")
 
-                context.log(
-                    "Warning: Encountered an unexpected slot structure. It is possible the \n"
-                    "    file header structure has been changed.")
+            chunk = self._decompressor.decompress(data, size)
+            if chunk:
+                buffer[:len(chunk)] = chunk
+                self._inflated += len(chunk)
+                return len(chunk)
 
-            position += 12
+        return 0
 
-            chunks[slot] = raw_contents[start: start + length]
 
-        if 1 not in chunks:
-            context.set_state('bad_header')
-            raise BadRpycException(
-                "Unable to find the right slot to load from the rpyc file. The file header "
-                f"structure has been changed. File header: {file_start}")
+def open_slot(contents):
+    """
+    Returns a buffered binary stream of the inflated contents of a blob found by read_rpyc_slot.
+    """
+    return BufferedReader(ZlibReader(contents), ZlibReader.CHUNK_SIZE)
 
-        contents = chunks[1]
 
+def read_ast_from_slot(contents, is_rpyc_v1, file_start, context):
+    """
+    Inflates and unpickles a blob found by read_rpyc_slot, returning the contained AST.
+    file_start should be the start of the file the blob was found in, for error reporting.
+    """
+    # The blob is inflated while it is being unpickled, but check up front if it is actually
+    # zlib compressed to properly report broken files.
+    stream = open_slot(contents)
     try:
-        contents = zlib.decompress(contents)
+        with context.timer("unpickle"):
+            stream.peek(1)
     except Exception:
         context.set_state('bad_header')
         raise BadRpycException(
             "Did not find a zlib compressed blob where it was expected. Either the header has been "
             f"modified or the file structure has been changed. File header: {file_start}") from None
 
-    # add some detection of ren'py 7 files
-    if is_rpyc_v1 or pickle_detect_python2(contents):
-        version = "6" if is_rpyc_v1 else "7"
+    try:
+        with context.timer("unpickle"):
+            _, stmts = pickle_safe_load(stream, detect_python2=True)
+
+    finally:
+        # add some detection of ren'py 7 files. This is noted while unpickling, and also warned
+        # about when unpickling failed, as it's a likely cause.
+        if is_rpyc_v1 or pickle_python2_detected():
+            version = "6" if is_rpyc_v1 else "7"
 
-        context.log(
-            "Warning: analysis found signs that this .rpyc file was generated by ren'py \n"
-           f'    version {version} or below, while this unrpyc version targets ren\'py \n'
-            "    version 8. Decompilation will still be attempted, but errors or incorrect \n"
-            "    decompilation might occur. ")
+            context.log(
+                "Warning: analysis found signs that this .rpyc file was generated by ren'py \n"
+               f'    version {version} or below, while this unrpyc version targets ren\'py \n'
+                "    version 8. Decompilation will still be attempted, but errors or incorrect \n"
+                "    decompilation might occur. ")
 
-    _, stmts = pickle_safe_loads(contents)
     return stmts
 
 
+def read_ast_from_file(in_file, context):
+    with context.timer("read"):
+        raw_contents = map_file(in_file)
+    with context.timer("header"):
+        contents, is_rpyc_v1 = read_rpyc_slot(raw_contents, context)
+    return read_ast_from_slot(contents, is_rpyc_v1, bytes(raw_contents[:50]), context)
+
+
 def get_ast(in_file, try_harder, context):
     """
     Opens the rpyc file at path in_file to load the contained AST.
@@ -200,16 +359,93 @@ def get_ast(in_file, try_harder, context):
     """
     with in_file.open('rb') as in_file:
         if try_harder:
-            ast = deobfuscate.read_ast(in_file, context)
+            with context.timer("deobfuscate"):
+                ast = deobfuscate.read_ast(in_file, context)
         else:
             ast = read_ast_from_file(in_file, context)
     return ast
 
 
-def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, dump=False,
-                   comparable=False, no_pyexpr=False, translator=None, init_offset=False,
-                   sl_custom_names=None):
+def decompile_ast(ast, context, dump=False, comparable=False, no_pyexpr=False, translator=None,
+                  init_offset=False, sl_custom_names=None):
+    """
+    Decompiles (or when dump is set, dumps) a loaded AST and returns the output as a string.
+    """
+    out_file = StringIO()
+    if dump:
+        with context.timer("decompile"):
+            astdump.pprint(out_file, ast, comparable=comparable, no_pyexpr=no_pyexpr)
+    else:
+        options = decompiler.Options(log=context.log_contents, translator=translator,
+                                     init_offset=init_offset, sl_custom_names=sl_custom_names,
+                                     timings=context.timings)
+
+        # the decompiler records the time spent translating itself, don't count that twice.
+        translating = context.timings.get("translate", 0.0)
+        cache_info = decompiler.util.expression_cache_info()
+        with context.timer("decompile"):
+            decompiler.pprint(out_file, ast, options)
+        context.add_timing("decompile", translating - context.timings.get("translate", 0.0))
+
+        for function, (hits, misses) in decompiler.util.expression_cache_info().items():
+            context.count(f"{function} hits", hits - cache_info[function][0])
+            context.count(f"{function} misses", misses - cache_info[function][1])
 
+    return out_file.getvalue()
+
+
+def decompile_bytes(data, context=None, try_harder=False, dump=False, comparable=False,
+                    no_pyexpr=False, translator=None, init_offset=False, sl_custom_names=None):
+    """
+    Decompiles (or when dump is set, dumps) the contents of a rpyc file, given as the bytes-like
+    object data, and returns the output as a string. Nothing is read from or written to the
+    filesystem. Log messages and timings are collected in context, if one is given.
+    """
+    if context is None:
+        context = Context()
+
+    in_file = MemoryReader(data)
+    if try_harder:
+        with context.timer("deobfuscate"):
+            ast = deobfuscate.read_ast(in_file, context)
+    else:
+        ast = read_ast_from_file(in_file, context)
+
+    return decompile_ast(ast, context, dump=dump, comparable=comparable, no_pyexpr=no_pyexpr,
+                         translator=translator, init_offset=init_offset,
+                         sl_custom_names=sl_custom_names)
+
+
+def decompile_many(items, parallelism=1, **options):
+    """
+    Decompiles the contents of many rpyc files, given as an iterable of (name, data) tuples, with
+    the options of decompile_bytes. This is a generator, yielding a (name, context) tuple for each
+    item in the order they were given in. If the context's state is "ok", its value is the output,
+    otherwise its error is the exception that was raised. Nothing is read from or written to the
+    filesystem.
+    With a parallelism above 1, the items are decompiled by that many worker processes. Items are
+    taken from the iterable as workers are ready for them, so it can be a generator.
+    """
+    if parallelism <= 1:
+        for name, data in items:
+            yield name, worker_bytes((options, (name, data)))
+        return
+
+    # the pool takes the items from a thread of its own and returns the results in order, so the
+    # names can simply be queued up as they are handed to it.
+    names = deque()
+
+    def tasks():
+        for name, data in items:
+            names.append(name)
+            yield name, data
+
+    with Pool(parallelism, init_worker, (worker_bytes, options)) as pool:
+        for context in pool.imap(run_task, tasks()):
+            yield names.popleft(), context
+
+
+def output_filename(input_filename, dump=False, output_roots=None):
     # Output filename is input filename but with .rpy extension
     if dump:
         ext = '.txt'
@@ -219,6 +455,32 @@ def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, d
         ext = '.rpym'
     out_filename = input_filename.with_suffix(ext)
 
+    # With an output root, the output is placed at the same place relative to the output root, as
+    # the input is relative to the input root.
+    if output_roots is not None:
+        input_root, output_root = output_roots
+        out_filename = output_root / out_filename.relative_to(input_root)
+    return out_filename
+
+
+def write_output(out_filename, output):
+    """Writes output to the file out_filename, creating the directory it's in if needed."""
+    out_filename.parent.mkdir(parents=True, exist_ok=True)
+    with out_filename.open('w', encoding='utf-8') as out_file:
+        out_file.write(output)
+
+
+def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, dump=False,
+                   comparable=False, no_pyexpr=False, translator=None, init_offset=False,
+                   sl_custom_names=None, cache=None, ast=None, write=True, output_roots=None):
+    """
+    Decompiles the file at input_filename and writes the output next to it, or to the matching
+    place below the output root if output_roots is (input root, output root). If write is False,
+    a tuple of the output filename and the output is returned in the context instead, for the
+    caller to write.
+    """
+
+    out_filename = output_filename(input_filename, dump, output_roots)
 
     if not overwrite and out_filename.exists():
         context.log(f'Skipping {input_filename}. {out_filename.name} already exists.')
@@ -226,20 +488,315 @@ def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, d
         return
 
     context.log(f'Decompiling {input_filename} to {out_filename.name} ...')
-    ast = get_ast(input_filename, try_harder, context)
+    decompile_options = dict(dump=dump, comparable=comparable, no_pyexpr=no_pyexpr,
+                             translator=translator, init_offset=init_offset,
+                             sl_custom_names=sl_custom_names)
 
-    with out_filename.open('w', encoding='utf-8') as out_file:
-        if dump:
-            astdump.pprint(out_file, ast, comparable=comparable, no_pyexpr=no_pyexpr)
+    if cache is None:
+        if ast is None:
+            ast = get_ast(input_filename, try_harder, context)
+        output = decompile_ast(ast, context, **decompile_options)
+
+    else:
+        with context.timer("read"):
+            with input_filename.open('rb') as in_file:
+                raw_contents = map_file(in_file)
+        if try_harder:
+            # obfuscated files cannot be trusted to have a sane slot structure, so key on
+            # the entire file instead.
+            key = cache.key(raw_contents)
         else:
-            options = decompiler.Options(log=context.log_contents, translator=translator,
-                                         init_offset=init_offset, sl_custom_names=sl_custom_names)
+            with context.timer("header"):
+                contents, is_rpyc_v1 = read_rpyc_slot(raw_contents, context)
+            key = cache.key(contents)
 
-            decompiler.pprint(out_file, ast, options)
+        with context.timer("cache"):
+            output = cache.get(key)
+        if output is not None:
+            context.log("Using cached output.")
+            context.cache_status = "hit"
+
+        else:
+            if ast is None and try_harder:
+                with context.timer("deobfuscate"):
+                    ast = deobfuscate.read_ast(BytesIO(raw_contents), context)
+            elif ast is None:
+                ast = read_ast_from_slot(contents, is_rpyc_v1, bytes(raw_contents[:50]),
+                                         context)
+            output = decompile_ast(ast, context, **decompile_options)
+            with context.timer("cache"):
+                cache.put(key, output)
+            context.cache_status = "miss"
+
+    if write:
+        with context.timer("write"):
+            write_output(out_filename, output)
+    else:
+        context.set_result((out_filename, output))
 
     context.set_state('ok')
 
 
+# Decompile cache
+
+class DecompileCache:
+    """
+    A persistent on-disk cache of decompiled output, shared between runs and worker processes.
+    Entries are keyed by a hash of the compressed AST blob of a file together with
+    `fingerprint`, which should identify every option that influences the output. When the
+    cache grows beyond max_size bytes, `evict` removes the least recently used entries.
+    """
+
+    STATS_FILE = "stats.json"
+
+    def __init__(self, directory, fingerprint, max_size):
+        self.directory = Path(directory)
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+
+    def key(self, payload):
+        digest = hashlib.sha256(self.fingerprint.encode("ascii"))
+        digest.update(payload)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.directory / key[:2] / f'{key}.rpy'
+
+    def get(self, key):
+        """
+        Returns the cached output for key, or None if it isn't in the cache.
+        """
+        path = self.path(key)
+        try:
+            output = path.read_bytes().decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        # the modification time doubles as the last time this entry was used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return output
+
+    def put(self, key, output):
+        """
+        Stores output in the cache under key. Entries are written atomically, so concurrent
+        workers will at worst do some redundant work.
+        """
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(output.encode("utf-8"))
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_size bytes.
+        Returns a tuple of (remaining entries, remaining size, evicted entries).
+        """
+        entries = []
+        for path in self.directory.glob("??/*.rpy"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort(reverse=True)
+        size = 0
+        kept = 0
+        evicted = 0
+        for _, entry_size, path in entries:
+            if size + entry_size <= self.max_size:
+                size += entry_size
+                kept += 1
+                continue
+
+            try:
+                path.unlink()
+            except OSError:
+                size += entry_size
+                kept += 1
+            else:
+                evicted += 1
+
+        return kept, size, evicted
+
+    def update_stats(self, hits, misses):
+        """
+        Adds the hits and misses of this run to the totals stored in the cache directory, and
+        returns the new totals as a tuple of (runs, hits, misses).
+        """
+        path = self.directory / self.STATS_FILE
+        try:
+            stats = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            stats = {}
+
+        stats = {
+            "runs": stats.get("runs", 0) + 1,
+            "hits": stats.get("hits", 0) + hits,
+            "misses": stats.get("misses", 0) + misses}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(stats), encoding="utf-8")
+        return stats["runs"], stats["hits"], stats["misses"]
+
+
+def options_fingerprint(args):
+    """
+    Computes a string identifying all options in args that influence decompilation output.
+    """
+    sl_custom_names = sorted((args.sl_custom_names or {}).items())
+    options = repr((__version__, args.try_harder, args.dump, args.comparable, args.no_pyexpr,
+                    args.init_offset, sl_custom_names))
+
+    digest = hashlib.sha256(options.encode("utf-8"))
+    if args.translator:
+        digest.update(args.translator)
+    return digest.hexdigest()
+
+
+# Incremental decompilation
+
+class Manifest:
+    """
+    Records the state of every input file at the time it was last decompiled, so later runs can
+    tell which files changed. It is stored as a json file, with all paths relative to the
+    directory that contains it.
+    """
+
+    FILENAME = "unrpyc-manifest.json"
+    VERSION = 1
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.root = path.parent
+        self.fingerprint = fingerprint
+        # maps input paths (relative to root) to dicts of size, mtime_ns, digest and output
+        self.entries = {}
+        # whether the entries were recorded with options that produce different output. Their
+        # outputs are still ours to replace, but none of them are up to date.
+        self.outdated = False
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """
+        Loads the manifest at path. If it doesn't exist or is unreadable, an empty manifest is
+        returned instead. If it was made with options that produce different output, its entries
+        are kept but marked as outdated.
+        """
+        manifest = cls(path, fingerprint)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return manifest
+
+        if data.get("version") == cls.VERSION:
+            manifest.entries = data.get("files", {})
+            manifest.outdated = data.get("fingerprint") != fingerprint
+        return manifest
+
+    def save(self):
+        data = {"version": self.VERSION, "fingerprint": self.fingerprint, "files": self.entries}
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(json.dumps(data, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(temp_path, self.path)
+
+    def relative(self, path):
+        # outputs can be outside of the root when using an output root
+        return Path(os.path.relpath(path, self.root)).as_posix()
+
+    def is_unchanged(self, input_filename, out_filename):
+        """
+        Checks if input_filename is identical to when its output was recorded, and that output
+        still exists. Files whose size or modification time changed are hashed to confirm this.
+        """
+        entry = self.entries.get(self.relative(input_filename))
+        if self.outdated or entry is None or entry["output"] != self.relative(out_filename):
+            return False
+
+        if not out_filename.exists():
+            return False
+
+        stat = input_filename.stat()
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        if entry["size"] != stat.st_size or entry["digest"] != file_digest(input_filename):
+            return False
+
+        # only the modification time changed, remember the new one.
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def is_recorded(self, input_filename):
+        return self.relative(input_filename) in self.entries
+
+    def record(self, input_filename, out_filename):
+        stat = input_filename.stat()
+        self.entries[self.relative(input_filename)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "digest": file_digest(input_filename),
+            "output": self.relative(out_filename)}
+
+    def discard(self, input_filename):
+        """Forgets input_filename and deletes the output recorded for it."""
+        entry = self.entries.pop(self.relative(input_filename))
+        try:
+            (self.root / entry["output"]).unlink()
+        except FileNotFoundError:
+            pass
+
+    def remove_stale(self):
+        """
+        Deletes the outputs of recorded input files that no longer exist, and forgets them.
+        Returns the amount of deleted outputs.
+        """
+        removed = 0
+        for name, entry in list(self.entries.items()):
+            if (self.root / name).exists():
+                continue
+
+            del self.entries[name]
+            try:
+                (self.root / entry["output"]).unlink()
+            except FileNotFoundError:
+                pass
+            else:
+                removed += 1
+
+        return removed
+
+
+def file_digest(filename):
+    return hashlib.sha256(filename.read_bytes()).hexdigest()
+
+
+# the decompiler ends all of its output with this line
+OUTPUT_MARKER = b"# Decompiled by unrpyc: https://github.com/CensoredUsername/unrpyc"
+
+
+def is_unrpyc_output(filename):
+    """Checks if the file at filename exists and ends like output of the decompiler does."""
+    try:
+        with filename.open('rb') as in_file:
+            size = in_file.seek(0, os.SEEK_END)
+            in_file.seek(max(size - 256, 0))
+            return OUTPUT_MARKER in in_file.read()
+    except OSError:
+        return False
+
+
 def worker_tl(arg_tup):
     """
     This file implements the first pass of the translation feature. It gathers TL-data from the
@@ -253,8 +810,14 @@ def worker_tl(arg_tup):
         context.log(f'Extracting translations from {filename}...')
         ast = get_ast(filename, args.try_harder, context)
 
-        tl_inst = translate.Translator(args.translate, True)
-        tl_inst.translate_dialogue(ast)
+        # Extracting translations modifies the AST, so check this beforehand.
+        # Files that are decompiled in parts are left for the second pass.
+        early = (args.early_decompile and not is_split(args, filename.stat().st_size)
+                 and not translate.has_translatable_content(ast))
+
+        with context.timer("extract"):
+            tl_inst = translate.Translator(args.translate, True)
+            tl_inst.translate_dialogue(ast)
 
         # this object has to be sent back to the main process, for which it needs to be pickled.
         # the default pickler cannot pickle fake classes correctly, so manually handle that here.
@@ -265,6 +828,32 @@ def worker_tl(arg_tup):
         context.set_error(e)
         context.log(f'Error while extracting translations from {filename}:')
         context.log(traceback.format_exc())
+        return context
+
+    # Nothing in this file depends on the translations gathered from other files, so decompile it
+    # right away instead of loading it again in the second pass.
+    if early:
+        result = Context()
+        result.log_contents = context.log_contents
+
+        cache = None
+        if args.cache_dir:
+            cache = DecompileCache(args.cache_dir, args.options_fingerprint, args.cache_size)
+
+        try:
+            decompile_rpyc(
+                filename, result, overwrite=args.overwrite, try_harder=args.try_harder,
+                dump=args.dump, no_pyexpr=args.no_pyexpr, comparable=args.comparable,
+                init_offset=args.init_offset, sl_custom_names=args.sl_custom_names,
+                cache=cache, ast=ast, write=not args.output_bundle,
+                output_roots=args.output_roots)
+
+        except Exception as e:
+            result.set_error(e)
+            result.log(f'Error while decompiling {filename}:')
+            result.log(traceback.format_exc())
+
+        context.decompile_result = result
 
     return context
 
@@ -278,15 +867,17 @@ def worker_common(arg_tup):
     args, filename = arg_tup
     context = Context()
 
-    if args.translator:
-        args.translator = pickle_loads(args.translator)
+    cache = None
+    if args.cache_dir:
+        cache = DecompileCache(args.cache_dir, args.options_fingerprint, args.cache_size)
 
     try:
         decompile_rpyc(
-            filename, context, overwrite=args.clobber, try_harder=args.try_harder,
+            filename, context, overwrite=args.overwrite, try_harder=args.try_harder,
             dump=args.dump, no_pyexpr=args.no_pyexpr, comparable=args.comparable,
             init_offset=args.init_offset, sl_custom_names=args.sl_custom_names,
-            translator=args.translator)
+            translator=file_translator(_worker_translator), cache=cache,
+            write=not (args.io_threads or args.output_bundle), output_roots=args.output_roots)
 
     except Exception as e:
         context.set_error(e)
@@ -296,28 +887,580 @@ def worker_common(arg_tup):
     return context
 
 
-def run_workers(worker, common_args, private_args, parallelism):
+def worker_bytes(arg_tup):
     """
-    Runs worker in parallel using multiprocessing, with a max of `parallelism` processes.
-    Workers are called as worker((common_args, private_args[i])).
-    Workers should return an instance of `Context` as return value.
+    The worker of decompile_many. arg_tup is (options, (name, data)), where options are keyword
+    arguments to decompile_bytes. The output is returned in the context.
     """
+    options, (name, data) = arg_tup
+    options = dict(options, translator=file_translator(options.get("translator")))
+    context = Context()
 
-    worker_args = ((common_args, x) for x in private_args)
+    try:
+        context.set_result(decompile_bytes(data, context, **options))
+        context.set_state('ok')
 
-    results = []
-    with Pool(parallelism) as pool:
-        for result in pool.imap(worker, worker_args, 1):
-            results.append(result)
+    except Exception as e:
+        context.set_error(e)
+        context.log(f'Error while decompiling {name}:')
+        context.log(traceback.format_exc())
 
-            for line in result.log_contents:
-                print(line)
+    return context
+
+
+def file_translator(shared):
+    """
+    Returns a translator for decompiling a single file using the translations gathered in the
+    translator `shared`, or None if there is none. The translator tracks the identifiers it
+    generated within a file, so every file needs a fresh one.
+    """
+    if shared is None:
+        return None
+
+    translator = translate.Translator(shared.language)
+    translator.dialogue = shared.dialogue
+    translator.strings = shared.strings
+    return translator
+
+
+def is_split(args, size):
+    """Returns whether a file of the given size should be decompiled in parts."""
+    return args.split > 1 and size >= args.split_size
+
+
+def worker_part(arg_tup):
+    """
+    Decompiles a part of a file that is decompiled in parts. arg_tup is (args, (filename, part)).
+    Returns a tuple of the output of the part and its start and end state in the context, or
+    None if the file could not be split into that many parts.
+    """
+    global _worker_split_file
+
+    args, (filename, part) = arg_tup
+    context = Context()
+
+    options = decompiler.Options(log=context.log_contents,
+                                 translator=file_translator(_worker_translator),
+                                 init_offset=args.init_offset,
+                                 sl_custom_names=args.sl_custom_names, timings=context.timings)
 
+    try:
+        if _worker_split_file is None or _worker_split_file[0] != filename:
+            _worker_split_file = None
+            context.log(f'Loading {filename} to decompile it in parts ...')
+            ast = get_ast(filename, args.try_harder, context)
+            boundaries = decompiler.split(ast, args.split, options)
+            _worker_split_file = (filename, ast, boundaries)
+        _, ast, boundaries = _worker_split_file
+
+        if part + 1 < len(boundaries):
+            out_file = StringIO()
+            cache_info = decompiler.util.expression_cache_info()
+            with context.timer("decompile"):
+                start, end = decompiler.pprint_part(
+                    out_file, ast, boundaries[part], boundaries[part + 1], options)
+            context.set_result((out_file.getvalue(), start, end))
+
+            for function, (hits, misses) in decompiler.util.expression_cache_info().items():
+                context.count(f"{function} hits", hits - cache_info[function][0])
+                context.count(f"{function} misses", misses - cache_info[function][1])
+
+        context.set_state("ok")
+
+    except Exception as e:
+        context.set_error(e)
+        context.log(f'Error while decompiling part {part + 1} of {filename}:')
+        context.log(traceback.format_exc())
+
+    return context
+
+
+def run_split_workers(args, filenames, parallelism):
+    """
+    Decompiles every file in filenames by splitting it into args.split parts that are
+    decompiled in parallel, and stitching their output back together. Files whose parts can't be
+    stitched together without changing the output are decompiled in one piece instead.
+    This is a generator, yielding (filename, context) tuples in order of completion. When writing
+    to an output bundle, the output is returned in the context like decompile_rpyc does. The
+    context of a file holds the logs of all its parts, which are printed as they complete like
+    run_workers does, followed by what happened to the file as a whole.
+    """
+    contexts = {}
+    results = {}
+    parts = []
+    for filename in filenames:
+        context = Context()
+        out_filename = output_filename(filename, output_roots=args.output_roots)
+        if not args.overwrite and out_filename.exists():
+            context.log(f'Skipping {filename}. {out_filename.name} already exists.')
+            context.set_state('skip')
+            for line in context.log_contents:
+                print(line)
             print("")
+            yield filename, context
+            continue
+
+        contexts[filename] = context
+        results[filename] = {}
+        parts.extend((filename, part) for part in range(args.split))
+
+    shared_translator = None
+    if args.translator:
+        shared_translator = pickle_loads(args.translator)
+
+    for (filename, part), result in run_workers(worker_part, args, parts,
+                                                min(parallelism, len(parts))):
+        context = contexts[filename]
+        context.elapsed += result.elapsed
+        for phase, seconds in result.timings.items():
+            context.add_timing(phase, seconds)
+        for name, amount in result.counters.items():
+            context.count(name, amount)
+        if result.peak_memory is not None:
+            context.peak_memory = max(context.peak_memory or 0, result.peak_memory)
+        # run_workers already printed these
+        context.log_contents.extend(result.log_contents)
+
+        results[filename][part] = result
+        if len(results[filename]) < args.split:
+            continue
+
+        part_results = [results[filename][i] for i in range(args.split)]
+        del results[filename]
+        out_filename = output_filename(filename, output_roots=args.output_roots)
+        relayed = len(context.log_contents)
+
+        failed = [x for x in part_results if x.state != "ok"]
+        output = None
+        if not failed:
+            output = decompiler.stitch([x.value for x in part_results if x.value is not None])
+            context.count("split")
+
+        if failed:
+            context.set_error(failed[0].error)
+            context.log(f'Decompiling {filename} in parts failed.')
+
+        elif output is None:
+            # this is never expected to happen, but nothing is lost but time if it does.
+            context.count("split fallback")
+            context.log(f'The parts of {filename} could not be put together, decompiling it in '
+                        'one piece instead.')
+            try:
+                decompile_rpyc(
+                    filename, context, overwrite=True, try_harder=args.try_harder,
+                    init_offset=args.init_offset, sl_custom_names=args.sl_custom_names,
+                    translator=file_translator(shared_translator),
+                    write=not args.output_bundle, output_roots=args.output_roots)
+
+            except Exception as e:
+                context.set_error(e)
+                context.log(f'Error while decompiling {filename}:')
+                context.log(traceback.format_exc())
+
+        else:
+            context.log(f'Decompiled {filename} to {out_filename.name} in '
+                        f'{plural_s(sum(x.value is not None for x in part_results), "part")}.')
+            if args.output_bundle:
+                context.set_result((out_filename, output))
+            else:
+                with context.timer("write"):
+                    write_output(out_filename, output)
+            context.set_state('ok')
+
+        for line in context.log_contents[relayed:]:
+            print(line)
+        print("")
+
+        yield filename, context
+
+
+# Files smaller than this (in bytes) are grouped into batches of about this size, so workers don't
+# spend most of their time waiting on the main process when there's many tiny files.
+BATCH_SIZE = 64 * 1024
+
+# The worker function and the arguments common to all its invocations. These are sent to each
+# worker process once, when it is started.
+_worker = None
+_worker_args = None
+
+# The translator used by worker_common. It's deserialized once when a worker process starts,
+# as it can be very large. The time that took is reported with the first file of each worker.
+_worker_translator = None
+_worker_setup_timings = {}
+
+# The ast of the file that this worker last decompiled a part of, so a worker that is handed
+# several parts of the same file only has to load it once. Stored as (filename, ast, boundaries).
+_worker_split_file = None
+
+# The profiler of this worker process when profiling was requested. Its statistics are written to
+# the profile directory after every batch, as pool workers do not get to clean up when exiting.
+_worker_profile = None
+
+
+def init_worker(worker, common_args):
+    global _worker, _worker_args, _worker_translator, _worker_setup_timings, _worker_profile
+    global _worker_split_file
+    _worker = worker
+    _worker_args = common_args
+    _worker_translator = None
+    _worker_setup_timings = {}
+    _worker_split_file = None
+    _worker_profile = None
+
+    if getattr(common_args, "profile", None):
+        _worker_profile = cProfile.Profile()
+
+    if getattr(common_args, "translator", None):
+        start = time.perf_counter()
+        if _worker_profile is not None:
+            _worker_profile.enable()
+        _worker_translator = pickle_loads(common_args.translator)
+        if _worker_profile is not None:
+            _worker_profile.disable()
+        _worker_setup_timings["translator load"] = time.perf_counter() - start
+
+
+def peak_memory():
+    """Returns the peak memory usage of this process in bytes, if the platform can tell."""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports this in bytes, others in KiB.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_batch(batch):
+    """
+    Runs the worker set up by init_worker on every item in batch. Returns a list of
+    (item, context) tuples.
+    """
+    global _worker_setup_timings
+
+    results = []
+    for private_arg in batch:
+        start = time.perf_counter()
+        if _worker_profile is None:
+            context = _worker((_worker_args, private_arg))
+        else:
+            context = _worker_profile.runcall(_worker, (_worker_args, private_arg))
+        context.elapsed = time.perf_counter() - start
+        context.peak_memory = peak_memory()
+
+        for phase, seconds in _worker_setup_timings.items():
+            context.add_timing(phase, seconds)
+        _worker_setup_timings = {}
+
+        results.append((private_arg, context))
+
+    if _worker_profile is not None:
+        _worker_profile.dump_stats(
+            _worker_args.profile / f'{_worker.__name__}-{os.getpid()}.pstats')
 
     return results
 
 
+def make_batches(private_args, sizes):
+    """
+    Splits private_args into batches, given the size of each of them. Items that are at least
+    BATCH_SIZE large get a batch of their own, smaller items are grouped until a batch reaches
+    BATCH_SIZE. The order of the items is kept.
+    """
+    batches = []
+    batch = []
+    batch_size = 0
+    for private_arg, size in zip(private_args, sizes):
+        if size >= BATCH_SIZE:
+            batches.append([private_arg])
+            continue
+
+        batch.append(private_arg)
+        batch_size += size
+        if batch_size >= BATCH_SIZE:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run_workers(worker, common_args, private_args, parallelism, sizes=None):
+    """
+    Runs worker in parallel using multiprocessing, with a max of `parallelism` processes.
+    Workers are called as worker((common_args, private_args[i])), and should return an instance
+    of `Context` as return value.
+    This is a generator, yielding (private_args[i], context) tuples in order of completion.
+    If the size of the work for each item is given in sizes, small items are batched together.
+    Items are started in the order they are given in.
+    """
+
+    if sizes is None:
+        batches = [[x] for x in private_args]
+    else:
+        batches = make_batches(private_args, sizes)
+
+    start = time.perf_counter()
+    busy = 0.0
+    count = 0
+    with Pool(parallelism, init_worker, (worker, common_args)) as pool:
+        for results in pool.imap_unordered(run_batch, batches):
+            for private_arg, result in results:
+                busy += result.elapsed
+                count += 1
+
+                for line in result.log_contents:
+                    print(line)
+
+                print("")
+
+                yield private_arg, result
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {plural_s(count, 'file')} in {elapsed:.2f} seconds "
+          f"({count / max(elapsed, 1e-9):.1f} files per second, {plural_s(len(batches), 'task')}). "
+          f"Workers were busy {100 * busy / max(elapsed * parallelism, 1e-9):.1f}% of the time.")
+    print("")
+
+
+class IOPipeline:
+    """
+    Takes the I/O of decompiling off the worker processes, using a few threads in the main
+    process. Input files are read ahead of the workers, so these find them in the cache of the
+    operating system, and the output the workers send back is written in the background.
+    Throughput is measured as bytes per second of time the threads spent on them.
+    """
+
+    # How many bytes of input to read ahead of the files that were completed, per worker.
+    WINDOW = 32 * 1024 * 1024
+
+    # The size of the reads used to read ahead.
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.executor = None
+        self.read_bytes = 0
+        self.read_seconds = 0.0
+        self.write_bytes = 0
+        self.write_seconds = 0.0
+
+    @staticmethod
+    def read(filename):
+        """Reads the file at filename and discards it. Returns its size and the time it took."""
+        start = time.perf_counter()
+        size = 0
+        buffer = bytearray(IOPipeline.CHUNK_SIZE)
+        try:
+            with filename.open('rb', buffering=0) as in_file:
+                while True:
+                    read = in_file.readinto(buffer)
+                    if not read:
+                        break
+                    size += read
+        except OSError:
+            # the worker will report this when it gets to the file
+            pass
+        return size, time.perf_counter() - start
+
+    @staticmethod
+    def write(filename, output):
+        """
+        Writes output to the file at filename like write_output does. Returns its size and the
+        time it took.
+        """
+        start = time.perf_counter()
+        write_output(filename, output)
+        return filename.stat().st_size, time.perf_counter() - start
+
+    def run(self, filenames, sizes, parallelism, results, write=True):
+        """
+        Wraps `results`, the (filename, context) tuples that run_workers yields for filenames,
+        reading every file before the workers get to it and writing the output filename and
+        output in their contexts. This is a generator, yielding (filename, context) tuples once
+        their output is written. If write is False, the output is left for the caller instead.
+        `sizes` maps filenames to the size of the file.
+        """
+        window = self.WINDOW * parallelism
+        ahead = 0
+        upcoming = iter(filenames)
+        prefetches = []
+        writes = {}
+
+        def prefetch():
+            nonlocal ahead
+            # always read at least one file ahead, no matter how large it is
+            while ahead < window or not prefetches:
+                filename = next(upcoming, None)
+                if filename is None:
+                    return
+                ahead += sizes[filename]
+                prefetches.append(self.executor.submit(self.read, filename))
+
+        def finish(future):
+            filename, context = writes.pop(future)
+            try:
+                size, seconds = future.result()
+            except Exception as e:
+                context.set_state("error")
+                context.set_error(e)
+                print(f'Error while writing the output of {filename}:')
+                print(traceback.format_exc())
+            else:
+                self.write_bytes += size
+                self.write_seconds += seconds
+                context.add_timing("write", seconds)
+            return filename, context
+
+        self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="unrpyc-io")
+        with self.executor:
+            prefetch()
+
+            for filename, context in results:
+                ahead -= sizes[filename]
+                prefetch()
+
+                if not write or context.state != "ok" or context.value is None:
+                    yield filename, context
+                    continue
+
+                out_filename, output = context.value
+                context.value = None
+                writes[self.executor.submit(
+                    self.write, out_filename, output)] = (filename, context)
+
+                for future in [x for x in writes if x.done()]:
+                    yield finish(future)
+
+            while writes:
+                done, _ = wait(writes, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield finish(future)
+
+            for future in prefetches:
+                size, seconds = future.result()
+                self.read_bytes += size
+                self.read_seconds += seconds
+
+        self.executor = None
+
+
+# Daemon
+
+def worker_serve(arg_tup):
+    """
+    Decompiles a file for a request to the daemon. arg_tup is (args, task), where task is either
+    ("path", filename, overwrite, write) to decompile the file at filename like worker_common, or
+    ("bytes", name, data) to decompile data as the contents of a rpyc file. Unless the output is
+    written to a file, it's returned in the context.
+    """
+    args, task = arg_tup
+    context = Context()
+
+    try:
+        if task[0] == "path":
+            _, filename, overwrite, write = task
+            # existing output only matters if we're going to replace it
+            decompile_rpyc(
+                filename, context, overwrite=overwrite or not write, try_harder=args.try_harder,
+                dump=args.dump, no_pyexpr=args.no_pyexpr, comparable=args.comparable,
+                init_offset=args.init_offset, sl_custom_names=args.sl_custom_names,
+                write=write)
+            if context.value is not None:
+                context.set_result(context.value[1])
+
+        else:
+            _, name, data = task
+            context.log(f'Decompiling {name} ...')
+            context.set_result(decompile_bytes(
+                data, context, try_harder=args.try_harder, dump=args.dump,
+                no_pyexpr=args.no_pyexpr, comparable=args.comparable,
+                init_offset=args.init_offset, sl_custom_names=args.sl_custom_names))
+            context.set_state("ok")
+
+    except Exception as e:
+        context.set_error(e)
+        context.log(f'Error while decompiling {task[1]}:')
+        context.log(traceback.format_exc())
+
+    finally:
+        # the daemon lives for a long time, don't keep archives mapped that may change meanwhile,
+        # nor the classes of every file it has seen
+        release_archives()
+        CLASS_FACTORY.reset()
+
+    return context
+
+
+def run_task(task):
+    """Runs the worker set up by init_worker on a single task, and returns its context."""
+    return _worker((_worker_args, task))
+
+
+def serve(args):
+    """
+    Runs the daemon. It keeps a pool of workers that already imported everything around, and
+    decompiles the files it is asked to over a unix socket at args.serve, until it is interrupted
+    or asked to shut down.
+    """
+    socket_path = args.serve.resolve()
+    if not daemon.claim_socket(socket_path):
+        return
+
+    with Pool(args.processes, init_worker, (worker_serve, args)) as pool:
+        print(f"Listening on {socket_path} with {plural_s(args.processes, 'worker')}.")
+        daemon.serve(socket_path, partial(pool.map, run_task), find_script_files)
+    print("The daemon was stopped.")
+
+
+def traverse(inpath):
+    """
+    Filters from input path for rpyc/rpymc files and returns them, including those in rpa
+    archives. Recurses into all given directories by calling itself.
+    """
+    if inpath.is_file() and inpath.suffix in ['.rpyc', '.rpymc']:
+        yield inpath
+    elif inpath.is_file() and inpath.suffix == '.rpa':
+        try:
+            yield from archive_members(inpath)
+        except (OSError, BadArchiveException) as e:
+            print(f'Unable to read archive {inpath}: {e}')
+    elif inpath.is_dir():
+        for item in inpath.iterdir():
+            yield from traverse(item)
+
+
+def drop_shadowed(files):
+    """
+    Removes the script files found by traverse that would have the same output as another one.
+    Like ren'py, files in archives are shadowed by loose files at the place they would be extracted
+    to. Of files in several archives, the one in the archive that sorts first is kept. Returns the
+    remaining files.
+    """
+    found = {}
+    for filename in files:
+        if not isinstance(filename, ArchiveMember):
+            found.setdefault(os.path.abspath(filename), filename)
+    remaining = list(found.values())
+
+    members = [x for x in files if isinstance(x, ArchiveMember)]
+    for member in sorted(members, key=lambda x: str(x.archive)):
+        place = os.path.abspath(member.path)
+        if place in found:
+            print(f'Ignoring {member}, as it is shadowed by {found[place]}.')
+            continue
+
+        found[place] = member
+        remaining.append(member)
+    return remaining
+
+
+def find_script_files(paths):
+    """Returns the script files found at all paths by traverse, without shadowed ones."""
+    return drop_shadowed([x for path in paths for x in traverse(path)])
+
+
 def parse_sl_custom_names(unparsed_arguments):
     # parse a list of strings in the format
     # classname=name-nchildren into {classname: (name, nchildren)}
@@ -355,7 +1498,20 @@ def parse_sl_custom_names(unparsed_arguments):
 
 def plural_s(n, unit):
     """Correctly uses the plural form of 'unit' when 'n' is not one"""
-    return f"1 {unit}" if n == 1 else f"{n} {unit}s"
+    if n == 1:
+        return f"1 {unit}"
+    elif unit.endswith("y"):
+        return f"{n} {unit[:-1]}ies"
+    elif unit.endswith("s"):
+        return f"{n} {unit}es"
+    return f"{n} {unit}s"
+
+
+def hit_rate(hits, misses):
+    """Formats the fraction of lookups that were hits as a percentage"""
+    if not hits + misses:
+        return "no lookups"
+    return f"{100 * hits / (hits + misses):.1f}% hit rate"
 
 
 def main():
@@ -371,7 +1527,7 @@ def main():
     ap.add_argument(
         'file',
         type=str,
-        nargs='+',
+        nargs='*',
         help="The filenames to decompile. "
         "All .rpyc files in any sub-/directories passed will also be decompiled.")
 
@@ -382,6 +1538,41 @@ def main():
         action='store_true',
         help="Overwrites output files if they already exist.")
 
+    ap.add_argument(
+        '--incremental',
+        dest='incremental',
+        action='store_true',
+        help="Only decompile files that changed since the last incremental run, and delete the "
+        "output of files that were removed since then. This state is kept in a "
+        f"'{Manifest.FILENAME}' file in the deepest directory containing all given paths.")
+
+    ap.add_argument(
+        '--output-root',
+        dest='output_root',
+        type=Path,
+        action='store',
+        help="Write the output below this directory instead of next to the input files, in the "
+        "same place relative to it as the input is relative to the deepest directory containing "
+        "all given paths. Files in .rpa archives are treated as if the archive was extracted in "
+        "its own directory.")
+
+    ap.add_argument(
+        '--output-bundle',
+        dest='output_bundle',
+        type=Path,
+        action='store',
+        help="Write all output into this single file instead of a file per input, named by their "
+        "path relative to the deepest directory containing all given paths. The format is chosen "
+        "by the extension: .zip, .tar (optionally .gz, .bz2 or .xz compressed) or .sqlite, which "
+        "stores them in a table called files.")
+
+    ap.add_argument(
+        '--bundle-logs',
+        dest='bundle_logs',
+        action='store_true',
+        help="Also store the log of every file in the output bundle, as the name of its output "
+        "followed by '.log'.")
+
     ap.add_argument(
         '--try-harder',
         dest="try_harder",
@@ -400,6 +1591,35 @@ def main():
         "Defaults to the amount of hw threads available minus one, disabled when multiprocessing is "
         "unavailable.")
 
+    ap.add_argument(
+        '--io-threads',
+        dest='io_threads',
+        type=int,
+        action='store',
+        default=0,
+        help="Read input files ahead of the workers and write their output in the background, "
+        "using this many threads. This keeps the workers busy when the files are on slow or "
+        "network storage. Disabled by default.")
+
+    ap.add_argument(
+        '--split',
+        dest='split',
+        type=int,
+        action='store',
+        default=1,
+        help="Split files into this many parts at their top-level statements, and decompile the "
+        "parts in parallel. This helps when most of a game is in a single large file, but every "
+        "part needs to load the entire file. The output is the same as without splitting.")
+
+    ap.add_argument(
+        '--split-size',
+        dest='split_size',
+        type=int,
+        action='store',
+        default=1024,
+        help="Only split files of at least this size in KiB when using '--split'. Defaults to "
+        "1024.")
+
     astdump = ap.add_argument_group('astdump options', 'All unrpyc options related to ast-dumping.')
     astdump.add_argument(
         '-d',
@@ -453,6 +1673,50 @@ def main():
         help="Changes the dialogue language in the decompiled script files, using a translation "
         "already present in the tl dir.")
 
+    cache = ap.add_argument_group('cache options', 'All unrpyc options related to the decompile '
+                                  'cache.')
+    cache.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        type=Path,
+        action='store',
+        help="Store decompiled output in a persistent cache in the given directory, and reuse it "
+        "for files whose contents and decompilation options have not changed since an earlier "
+        "run.")
+
+    cache.add_argument(
+        '--cache-size',
+        dest='cache_size',
+        type=int,
+        action='store',
+        default=256,
+        help="The maximum size of the decompile cache in MiB. When the cache grows beyond this, "
+        "the least recently used entries are removed at the end of a run. Defaults to 256.")
+
+    cache.add_argument(
+        '--cache-stats',
+        dest='cache_stats',
+        action='store_true',
+        help="Print a summary of cache hits and misses for this run and all earlier runs.")
+
+    ap.add_argument(
+        '--serve',
+        dest='serve',
+        type=Path,
+        action='store',
+        help="Instead of decompiling the given files, run as a daemon listening on a unix socket "
+        "at this path, keeping its workers around between requests. Use unrpyc_client.py to send "
+        "it files to decompile. The options that change how files are decompiled, such as "
+        "'--try-harder' or '--dump', apply to every request.")
+
+    ap.add_argument(
+        '--profile',
+        dest='profile',
+        type=Path,
+        action='store',
+        help="Profile the decompilation and write the statistics of every worker process to the "
+        "given directory, as files that can be read with the pstats module.")
+
     ap.add_argument(
         '--version',
         action='version',
@@ -461,12 +1725,85 @@ def main():
     args = ap.parse_args()
 
     # Catch impossible arg combinations so they don't produce strange errors or fail silently
+    if not args.file and not args.serve:
+        ap.error("the following arguments are required: file")
+
+    if args.serve and args.file:
+        ap.error("Option '--serve' cannot be used together with files to decompile.")
+
+    # the daemon only uses the options that change how files are decompiled, the client decides
+    # whether output is overwritten
+    serve_ignored = {
+        '--clobber': args.clobber,
+        '--incremental': args.incremental,
+        '--output-root': args.output_root,
+        '--output-bundle': args.output_bundle,
+        '--bundle-logs': args.bundle_logs,
+        '--io-threads': args.io_threads,
+        '--split': args.split != 1,
+        '--split-size': args.split_size != 1024,
+        '--translate': args.translate,
+        '--cache-dir': args.cache_dir,
+        '--cache-size': args.cache_size != 256,
+        '--cache-stats': args.cache_stats,
+        '--profile': args.profile,
+    }
+    if args.serve and any(serve_ignored.values()):
+        ap.error("Option '--serve' can't be used together with "
+                 f"{', '.join(repr(k) for k, v in serve_ignored.items() if v)}.")
+
     if (args.no_pyexpr or args.comparable) and not args.dump:
         ap.error("Options '--comparable' and '--no_pyexpr' require '--dump'.")
 
     if args.dump and args.translate:
         ap.error("Options '--translate' and '--dump' cannot be used together.")
 
+    if args.cache_stats and not args.cache_dir:
+        ap.error("Option '--cache-stats' requires '--cache-dir'.")
+
+    if args.output_bundle and args.output_root:
+        ap.error("Options '--output-bundle' and '--output-root' cannot be used together.")
+
+    if args.output_bundle and args.incremental:
+        ap.error("Options '--output-bundle' and '--incremental' cannot be used together.")
+
+    if args.bundle_logs and not args.output_bundle:
+        ap.error("Option '--bundle-logs' requires '--output-bundle'.")
+
+    if args.output_bundle:
+        args.output_bundle = args.output_bundle.resolve()
+        if args.output_bundle.exists() and not args.clobber:
+            print(f"The output bundle {args.output_bundle} already exists. To overwrite it, use "
+                  "the --clobber flag.")
+            return
+
+    # the outputs that already exist don't matter when writing to a bundle
+    args.overwrite = args.clobber or args.output_bundle is not None
+
+    if args.io_threads < 0:
+        ap.error("Option '--io-threads' cannot be negative.")
+
+    if args.split < 1:
+        ap.error("Option '--split' must be at least 1.")
+
+    if args.split > 1 and args.dump:
+        ap.error("Options '--split' and '--dump' cannot be used together.")
+
+    if args.split > 1 and args.cache_dir:
+        ap.error("Options '--split' and '--cache-dir' cannot be used together.")
+
+    if args.split_size < 0:
+        ap.error("Option '--split-size' cannot be negative.")
+    args.split_size *= 1024
+
+    if args.cache_size < 0:
+        ap.error("Option '--cache-size' cannot be negative.")
+    args.cache_size *= 1024 * 1024
+
+    if args.profile:
+        args.profile = args.profile.resolve()
+        args.profile.mkdir(parents=True, exist_ok=True)
+
     if args.sl_custom_names is not None:
         try:
             args.sl_custom_names = parse_sl_custom_names(args.sl_custom_names)
@@ -474,6 +1811,10 @@ def main():
             print("\n".join(e.args))
             return
 
+    if args.serve:
+        serve(args)
+        return
+
     def glob_or_complain(inpath):
         """Expands wildcards and casts output to pathlike state."""
         retval = [Path(elem).resolve(strict=True) for elem in glob.glob(inpath, recursive=True)]
@@ -481,24 +1822,16 @@ def main():
             print(f'Input path not found: {inpath}')
         return retval
 
-    def traverse(inpath):
-        """
-        Filters from input path for rpyc/rpymc files and returns them. Recurses into all given
-        directories by calling itself.
-        """
-        if inpath.is_file() and inpath.suffix in ['.rpyc', '.rpymc']:
-            yield inpath
-        elif inpath.is_dir():
-            for item in inpath.iterdir():
-                yield from traverse(item)
-
     # Check paths from argparse through globing and pathlib. Constructs a tasklist with all
     # `Ren'Py compiled files` the app was assigned to process.
     worklist = []
+    roots = []
     for entry in args.file:
         for globitem in glob_or_complain(entry):
+            roots.append(globitem if globitem.is_dir() else globitem.parent)
             for elem in traverse(globitem):
                 worklist.append(elem)
+    worklist = drop_shadowed(worklist)
 
     # Check if we actually have files. Don't worry about no parameters passed,
     # since ArgumentParser catches that
@@ -506,64 +1839,234 @@ def main():
         print("Found no script files to decompile.")
         return
 
-    if args.processes > len(worklist):
-        args.processes = len(worklist)
+    if args.incremental and any(isinstance(x, ArchiveMember) for x in worklist):
+        print("Files in .rpa archives cannot be decompiled incrementally.")
+        return
 
-    print(f"Found {plural_s(len(worklist), 'file')} to process. "
-          f"Performing decompilation using {plural_s(args.processes, 'worker')}.")
+    args.output_roots = None
+    if args.output_root:
+        args.output_roots = (Path(os.path.commonpath(roots)), args.output_root.resolve())
 
     # If a big file starts near the end, there could be a long time with only one thread running,
     # which is inefficient. Avoid this by starting big files first.
-    worklist.sort(key=lambda x: x.stat().st_size, reverse=True)
+    sizes = {x: x.stat().st_size for x in worklist}
+    worklist.sort(key=sizes.get, reverse=True)
+
+    # files that are decompiled in parts can keep several workers busy
+    tasks = sum(args.split if is_split(args, sizes[x]) else 1 for x in worklist)
+    if args.processes > tasks:
+        args.processes = tasks
+
+    print(f"Found {plural_s(len(worklist), 'file')} to process. "
+          f"Performing decompilation using {plural_s(args.processes, 'worker')}.")
 
     translation_errors = 0
     args.translator = None
-    if args.translate:
-        # For translation, we first need to analyse all files for translation data.
-        # We then collect all of these back into the main process, and build a
-        # datastructure of all of them. This datastructure is then passed to
-        # all decompiling processes.
-        # Note: because this data contains some FakeClasses, Multiprocessing cannot
-        # pass it between processes (it pickles them, and pickle will complain about
-        # these). Therefore, we need to manually pickle and unpickle it.
-
-        print("Step 1: analysing files for translations.")
-        results = run_workers(worker_tl, args, worklist, args.processes)
-
-        print('Compiling extracted translations.')
-        tl_dialogue = {}
-        tl_strings = {}
-        for entry in results:
-            if entry.state != "ok":
-                translation_errors += 1
-
-            if entry.value:
-                new_dialogue, new_strings = pickle_loads(entry.value)
-                tl_dialogue.update(new_dialogue)
-                tl_strings.update(new_strings)
-
-        translator = translate.Translator(None)
-        translator.dialogue = tl_dialogue
-        translator.strings = tl_strings
-        args.translator = pickle_safe_dumps(translator)
-
-        print("Step 2: decompiling.")
-
-    results = run_workers(worker_common, args, worklist, args.processes)
-
-    success = sum(result.state == "ok" for result in results)
-    skipped = sum(result.state == "skip" for result in results)
-    failed = sum(result.state == "error" for result in results)
-    broken = sum(result.state == "bad_header" for result in results)
+    states = Counter()
+    cache_statuses = Counter()
+    timings = Counter()
+    counters = Counter()
+    max_memory = peak_memory()
+    start = time.perf_counter()
+    pipeline = IOPipeline(args.io_threads) if args.io_threads else None
+
+    bundle = None
+    bundle_root = Path(os.path.commonpath(roots))
+    if args.output_bundle:
+        try:
+            bundle = OutputBundle.open(args.output_bundle)
+        except (OSError, ValueError, ImportError) as e:
+            print(f"Unable to create the output bundle: {e}")
+            return
+
+    try:
+        def store(filename, result):
+            """
+            Adds the output the worker returned for filename, and optionally its log, to the output
+            bundle, if there is one.
+            """
+            if bundle is None:
+                return
+
+            name = output_filename(filename, args.dump).relative_to(bundle_root).as_posix()
+            if result.state == "ok" and result.value is not None:
+                with result.timer("write"):
+                    bundle.add(name, result.value[1])
+                result.value = None
+
+            if args.bundle_logs:
+                bundle.add(f"{name}.log", "".join(f"{line}\n" for line in result.log_contents))
+
+        # Files without translatable content can be decompiled while translations are extracted from
+        # them. In incremental mode, which files need decompiling is only known after extraction.
+        args.early_decompile = not args.incremental
+        # This identifies the options used for decompiling without a translator. Early decompiled
+        # files don't depend on it so they use this, everything else gets the complete fingerprint
+        # later.
+        args.options_fingerprint = options_fingerprint(args)
+
+        if args.translate:
+            # For translation, we first need to analyse all files for translation data.
+            # We then collect all of these back into the main process, and build a
+            # datastructure of all of them. This datastructure is then passed to
+            # all decompiling processes.
+            # Note: because this data contains some FakeClasses, Multiprocessing cannot
+            # pass it between processes (it pickles them, and pickle will complain about
+            # these). Therefore, we need to manually pickle and unpickle it.
+
+            print("Step 1: analysing files for translations.")
+            tl_results = {}
+            decompiled = set()
+            for filename, result in run_workers(worker_tl, args, worklist, args.processes,
+                                                [sizes[x] for x in worklist]):
+                if result.state != "ok":
+                    translation_errors += 1
+
+                if result.value:
+                    tl_results[filename] = result.value
+
+                timings.update(result.timings)
+
+                if result.decompile_result is not None:
+                    decompiled.add(filename)
+                    store(filename, result.decompile_result)
+                    states[result.decompile_result.state] += 1
+                    cache_statuses[result.decompile_result.cache_status] += 1
+                    timings.update(result.decompile_result.timings)
+                    counters.update(result.decompile_result.counters)
+
+                if result.peak_memory is not None:
+                    max_memory = max(max_memory, result.peak_memory)
+
+            print('Compiling extracted translations.')
+            tl_dialogue = {}
+            tl_strings = {}
+            # Results arrive in order of completion, so merge them in worklist order to make sure
+            # any duplicates are resolved the same way every time.
+            for filename in worklist:
+                if filename in tl_results:
+                    new_dialogue, new_strings = pickle_loads(tl_results.pop(filename))
+                    tl_dialogue.update(new_dialogue)
+                    tl_strings.update(new_strings)
+
+            translator = translate.Translator(None)
+            translator.dialogue = tl_dialogue
+            translator.strings = tl_strings
+            args.translator = pickle_safe_dumps(translator)
+
+            if decompiled:
+                print(f"{plural_s(len(decompiled), 'file')} without translatable content were "
+                      "already decompiled.")
+                worklist = [x for x in worklist if x not in decompiled]
+
+            print("Step 2: decompiling.")
+
+        args.options_fingerprint = options_fingerprint(args)
+
+        unchanged = 0
+        stale = 0
+        manifest = None
+        if args.incremental:
+            manifest = Manifest.load(Path(os.path.commonpath(roots)) / Manifest.FILENAME,
+                                     args.options_fingerprint)
+            stale = manifest.remove_stale()
+            if manifest.outdated:
+                print("The options changed since the last run, decompiling all files again.")
+
+            changed = []
+            unrecorded = 0
+            for filename in worklist:
+                out_filename = output_filename(filename, args.dump, args.output_roots)
+                if manifest.is_unchanged(filename, out_filename):
+                    unchanged += 1
+                    continue
+
+                # we wrote this output ourselves, so it's safe to replace it
+                if manifest.is_recorded(filename):
+                    manifest.discard(filename)
+
+                # output of a run that this manifest didn't record, like a run that wasn't
+                # incremental or one with a manifest elsewhere. It could be outdated, so replace it
+                # as well. Anything else that's in the way is left alone.
+                elif is_unrpyc_output(out_filename):
+                    out_filename.unlink()
+                    unrecorded += 1
+
+                changed.append(filename)
+
+            worklist = changed
+            print(f"{plural_s(unchanged, 'file')} did not change since the last run.")
+            if unrecorded:
+                print(f"Replacing the output of {plural_s(unrecorded, 'file')} that an earlier run "
+                      "decompiled without recording it.")
+
+        split_files = [x for x in worklist if is_split(args, sizes[x])]
+        if split_files:
+            worklist = [x for x in worklist if not is_split(args, sizes[x])]
+            print(f"Decompiling {plural_s(len(split_files), 'file')} in "
+                  f"{plural_s(args.split, 'part')} each.")
+
+            for filename, result in run_split_workers(args, split_files, args.processes):
+                store(filename, result)
+                states[result.state] += 1
+                timings.update(result.timings)
+                counters.update(result.counters)
+                if result.peak_memory is not None:
+                    max_memory = max(max_memory, result.peak_memory)
+
+                if manifest is not None and result.state == "ok":
+                    manifest.record(filename,
+                                    output_filename(filename, output_roots=args.output_roots))
+
+        if worklist:
+            parallelism = min(args.processes, len(worklist))
+            results = run_workers(worker_common, args, worklist, parallelism,
+                                  [sizes[x] for x in worklist])
+            if pipeline is not None:
+                results = pipeline.run(worklist, sizes, parallelism, results, write=bundle is None)
+
+            for filename, result in results:
+                store(filename, result)
+                states[result.state] += 1
+                cache_statuses[result.cache_status] += 1
+                timings.update(result.timings)
+                counters.update(result.counters)
+                if result.peak_memory is not None:
+                    max_memory = max(max_memory, result.peak_memory)
+
+                if manifest is not None and result.state == "ok":
+                    manifest.record(filename,
+                                    output_filename(filename, args.dump, args.output_roots))
+
+        if manifest is not None:
+            manifest.save()
+
+        if bundle is not None:
+            bundle.close()
+    finally:
+        # don't leave a partially written bundle behind when the run didn't finish
+        if bundle is not None:
+            bundle.discard()
+
+    success = states["ok"]
+    skipped = states["skip"]
+    failed = states["error"]
+    broken = states["bad_header"]
 
     print("")
     print(f"{55 * '-'}")
     print(f"{__title__} {__version__} results summary:")
     print(f"{55 * '-'}")
-    print(f"Processed {plural_s(len(results), 'file')}.")
+    print(f"Processed {plural_s(sum(states.values()) + unchanged, 'file')}.")
 
     print(f"> {plural_s(success, 'file')} were successfully decompiled.")
 
+    if unchanged:
+        print(f"> {plural_s(unchanged, 'file')} were unchanged since the last run.")
+
+    if stale:
+        print(f"> {plural_s(stale, 'output file')} of removed input files were deleted.")
+
     if broken:
         print(f"> {plural_s(broken, 'file')} did not have the correct header, "
               "these were ignored.")
@@ -577,6 +2080,71 @@ def main():
     if translation_errors:
         print(f"> {plural_s(translation_errors, 'file')} failed translation extraction.")
 
+    if counters["split"]:
+        print(f"> {plural_s(counters['split'], 'file')} were decompiled in parts, "
+              f"{counters['split fallback']} of which had to be decompiled in one piece after "
+              "all.")
+
+    if args.translate and worklist:
+        print(f"> Translating took {1000 * timings['translate'] / len(worklist):.2f} ms per "
+              f"file, loading the translator took {timings['translator load']:.2f} seconds in "
+              "total.")
+
+    elapsed = time.perf_counter() - start
+    input_size = sum(sizes.values()) / (1024 * 1024)
+    print(f"> Throughput: {input_size:.1f} MiB of input in {elapsed:.2f} seconds "
+          f"({input_size / max(elapsed, 1e-9):.1f} MiB/s).")
+
+    if bundle is not None:
+        print(f"> Output was written to {args.output_bundle}, "
+              f"{plural_s(bundle.entries, 'entry')} with {bundle.size / (1024 * 1024):.1f} MiB of "
+              "text.")
+
+    if pipeline is not None:
+        mib = 1024 * 1024
+        read_speed = pipeline.read_bytes / max(pipeline.read_seconds, 1e-9) / mib
+        write_speed = pipeline.write_bytes / max(pipeline.write_seconds, 1e-9) / mib
+        print(f"> I/O threads read {pipeline.read_bytes / mib:.1f} MiB ahead of the workers "
+              f"({read_speed:.1f} MiB/s) and wrote {pipeline.write_bytes / mib:.1f} MiB of output "
+              f"({write_speed:.1f} MiB/s).")
+
+    if timings:
+        total = sum(timings.values())
+        phases = ", ".join(f"{phase} {seconds:.2f} s ({100 * seconds / total:.0f}%)"
+                           for phase, seconds in timings.most_common())
+        print(f"> Time spent per phase: {phases}.")
+
+    caches = []
+    for function in decompiler.util.expression_cache_info():
+        hits, misses = counters[f'{function} hits'], counters[f'{function} misses']
+        if hits or misses:
+            caches.append(f"{function} {hits} hits, {misses} misses ({hit_rate(hits, misses)})")
+    if caches:
+        print(f"> Expression caches: {'; '.join(caches)}.")
+
+    if args.profile:
+        print(f"> Profiling statistics of every worker were written to {args.profile}.")
+
+    if max_memory is not None:
+        print(f"> Peak memory usage of a single process was {max_memory / (1024 * 1024):.1f} "
+              "MiB.")
+
+    if args.cache_dir:
+        cache = DecompileCache(args.cache_dir, args.options_fingerprint, args.cache_size)
+        hits = cache_statuses["hit"]
+        misses = cache_statuses["miss"]
+        runs, total_hits, total_misses = cache.update_stats(hits, misses)
+        entries, size, evicted = cache.evict()
+
+        if args.cache_stats:
+            print(f"> Cache: {plural_s(hits, 'hit')} and {plural_s(misses, 'miss')} this run "
+                  f"({hit_rate(hits, misses)}).")
+            print(f"> Cache: {plural_s(total_hits, 'hit')} and "
+                  f"{plural_s(total_misses, 'miss')} over {plural_s(runs, 'run')} "
+                  f"({hit_rate(total_hits, total_misses)}).")
+            print(f"> Cache: {plural_s(entries, 'entry')} using {size / (1024 * 1024):.1f} MiB "
+                  f"after evicting {plural_s(evicted, 'entry')}.")
+
 
     if skipped:
         print("")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2012-2024 Yuri K. Schlesner, CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A thin client for the daemon started with `unrpyc.py --serve path/to/socket`. It only uses the
+standard library and doesn't import the decompiler, so it starts quickly. The protocol it speaks
+is described in unrpyc_tools/daemon_protocol.py.
+"""
+
+import argparse
+import socket
+import sys
+import time
+from pathlib import Path
+
+from unrpyc_tools.daemon_protocol import MAX_RESPONSE_SIZE, ProtocolError, recv_message, send_message
+
+
+class RequestError(Exception):
+    """Exception raised when the daemon responds to a request with an error"""
+    pass
+
+
+def request(socket_path, message, payload=b""):
+    """
+    Sends a request to the daemon listening at socket_path, and returns its response. Raises
+    RequestError if the daemon responded with an error instead.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        send_message(sock, message, payload)
+        response, _ = recv_message(sock, MAX_RESPONSE_SIZE, 0)
+
+    if "error" in response:
+        raise RequestError(response["error"])
+    return response
+
+
+# Command line interface
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Decompile .rpyc/.rpymc files using a daemon started with "
+        "'unrpyc.py --serve'.")
+
+    ap.add_argument(
+        'socket',
+        type=Path,
+        help="The socket the daemon is listening on.")
+
+    ap.add_argument(
+        'file',
+        type=Path,
+        nargs='*',
+        help="The files to decompile. Directories and .rpa archives are searched for them by "
+        "the daemon.")
+
+    ap.add_argument(
+        '-c',
+        '--clobber',
+        dest='clobber',
+        action='store_true',
+        help="Overwrites output files if they already exist.")
+
+    ap.add_argument(
+        '--send',
+        dest='send',
+        action='store_true',
+        help="Send the contents of the files to the daemon instead of their paths, and write the "
+        "output here. Use this when the daemon can't access the files.")
+
+    ap.add_argument(
+        '--stdout',
+        dest='stdout',
+        action='store_true',
+        help="Print the output instead of writing it to files.")
+
+    ap.add_argument(
+        '--ping',
+        dest='ping',
+        action='store_true',
+        help="Check if the daemon is running.")
+
+    ap.add_argument(
+        '--shutdown',
+        dest='shutdown',
+        action='store_true',
+        help="Stop the daemon.")
+
+    args = ap.parse_intermixed_args()
+
+    if args.ping or args.shutdown:
+        command = "ping" if args.ping else "shutdown"
+        try:
+            request(args.socket, {"command": command})
+        except (OSError, ProtocolError, RequestError) as e:
+            print(f"The daemon at {args.socket} is not reachable: {e}")
+            sys.exit(1)
+        print("The daemon is running." if args.ping else "The daemon was stopped.")
+        return
+
+    if not args.file:
+        ap.error("No files given to decompile.")
+
+    start = time.perf_counter()
+    results = []
+    try:
+        if args.send:
+            for filename in args.file:
+                response = request(args.socket, {"command": "decompile_bytes",
+                                                 "name": str(filename)},
+                                   filename.read_bytes())
+                results.extend(response["results"])
+        else:
+            response = request(args.socket, {"command": "decompile",
+                                             "paths": [str(x.resolve()) for x in args.file],
+                                             "overwrite": args.clobber,
+                                             "write": not args.stdout})
+            results.extend(response["results"])
+    except (OSError, ProtocolError) as e:
+        print(f"Unable to talk to the daemon at {args.socket}: {e}")
+        sys.exit(1)
+    except RequestError as e:
+        print(f"The daemon refused the request: {e}")
+        sys.exit(1)
+
+    failed = 0
+    for result in results:
+        for line in result["log"]:
+            print(line, file=sys.stderr)
+
+        if result["state"] not in ("ok", "skip"):
+            failed += 1
+            continue
+
+        output = result.get("output")
+        if output is None:
+            continue
+
+        if args.stdout:
+            sys.stdout.write(output)
+            continue
+
+        out_filename = Path(result["name"]).with_suffix(
+            ".rpym" if result["name"].endswith(".rpymc") else ".rpy")
+        if out_filename.exists() and not args.clobber:
+            print(f"Skipping {result['name']}. {out_filename.name} already exists.",
+                  file=sys.stderr)
+            continue
+        with out_filename.open('w', encoding='utf-8') as out_file:
+            out_file.write(output)
+
+    print(f"Decompiled {len(results) - failed} of {len(results)} files in "
+          f"{1000 * (time.perf_counter() - start):.1f} ms.", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# Copyright (c) 2012-2024 Yuri K. Schlesner, CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Reading the script files in ren'py's .rpa archives, without extracting them. The files in an
+# archive are presented as ArchiveMember objects, which can be used in place of the path of an
+# input file.
+
+import mmap
+import os
+import pickle
+import zlib
+from io import BytesIO, RawIOBase
+from pathlib import PurePosixPath, PureWindowsPath
+
+
+class BadArchiveException(Exception):
+    """Exception raised when we couldn't parse the index of a rpa archive"""
+    pass
+
+
+class MemoryReader(RawIOBase):
+    """
+    A readable and seekable raw stream of the bytes-like object data, which doesn't copy it.
+    map_file returns the data itself for these.
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self.view = memoryview(data)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self.view)
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer):
+        data = self.view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def _encode_latin1(string, encoding):
+    if encoding != "latin1":
+        raise pickle.UnpicklingError(f"Unexpected encoding {encoding!r} in archive index")
+    return string.encode("latin-1")
+
+
+class ArchiveIndexUnpickler(pickle.Unpickler):
+    """
+    Unpickles the index of a rpa archive. This only contains containers, numbers and strings,
+    but as ren'py pickles it with protocol 2, bytes are stored as calls to bytes or
+    _codecs.encode. Loading anything else is refused, so this is safe to use on untrusted data.
+    """
+
+    SAFE_GLOBALS = {
+        ("__builtin__", "bytes"): bytes,
+        ("builtins", "bytes"): bytes,
+        ("_codecs", "encode"): _encode_latin1,
+    }
+
+    def find_class(self, module, name):
+        try:
+            return self.SAFE_GLOBALS[module, name]
+        except KeyError:
+            raise pickle.UnpicklingError(
+                f"Unexpected object {module}.{name} in archive index") from None
+
+
+# The memory mapped contents of the archives opened by this process, by path. Stored as
+# (identity, view), where identity is the device, inode, size and modification time of the file
+# that was mapped, so archives that were replaced or changed since get mapped again.
+_archive_views = {}
+
+
+def map_archive(path):
+    """Returns a read-only memoryview of the contents of the archive at path."""
+    stat = path.stat()
+    identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    cached = _archive_views.get(path)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+
+    with path.open('rb') as in_file:
+        try:
+            view = memoryview(mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            # an empty file, or something that can't be mapped
+            view = memoryview(in_file.read())
+    _archive_views[path] = (identity, view)
+    return view
+
+
+def release_archives():
+    """
+    Forgets the archives mapped by this process. They are unmapped once nothing read from them is
+    in use anymore. Long-running processes call this when they're done with a task, so they don't
+    keep archives mapped forever.
+    """
+    _archive_views.clear()
+
+
+def read_archive_index(path):
+    """
+    Parses the index of the rpa archive at path. Returns a dict mapping the names of the files in
+    it to (offset, length, prefix) tuples, where the contents of a file are prefix followed by
+    length bytes at offset. Supports RPA-2.0, RPA-3.0 and RPA-3.2 archives.
+    """
+    with path.open('rb') as in_file:
+        header = in_file.readline(256)
+        fields = header.split()
+        try:
+            if header.startswith(b"RPA-3.2 "):
+                offset = int(fields[1], 16)
+                key = 0
+                for subkey in fields[3:]:
+                    key ^= int(subkey, 16)
+            elif header.startswith(b"RPA-3.0 "):
+                offset = int(fields[1], 16)
+                key = 0
+                for subkey in fields[2:]:
+                    key ^= int(subkey, 16)
+            elif header.startswith(b"RPA-2.0 "):
+                offset = int(fields[1], 16)
+                key = 0
+            else:
+                raise BadArchiveException(f"Unsupported archive header: {header[:16]}")
+        except (IndexError, ValueError):
+            raise BadArchiveException(f"Malformed archive header: {header[:64]}") from None
+
+        in_file.seek(offset)
+        try:
+            index = ArchiveIndexUnpickler(BytesIO(zlib.decompress(in_file.read())),
+                                          fix_imports=False).load()
+        except Exception as e:
+            raise BadArchiveException(f"Unable to read the archive index: {e}") from None
+
+    entries = {}
+    for name, parts in index.items():
+        # files are always stored in one part nowadays, older versions of ren'py never read
+        # anything beyond that either.
+        offset, length, *prefix = parts[0]
+        prefix = prefix[0] if prefix else b""
+        if isinstance(prefix, str):
+            prefix = prefix.encode("latin-1")
+        if isinstance(name, bytes):
+            name = name.decode("utf-8")
+        entries[name] = (offset ^ key, length ^ key, prefix)
+    return entries
+
+
+def archive_members(path):
+    """
+    Returns an ArchiveMember for every script file in the rpa archive at path. Files with names
+    that would place them outside of the game directory are left out.
+    """
+    members = []
+    for name, (offset, length, prefix) in sorted(read_archive_index(path).items()):
+        if not name.endswith(('.rpyc', '.rpymc')):
+            continue
+
+        posix_name = PurePosixPath(name.replace("\\", "/"))
+        if posix_name.is_absolute() or ".." in posix_name.parts or PureWindowsPath(name).drive:
+            print(f'Ignoring {name} in {path}, as it would be outside of the game directory.')
+            continue
+
+        members.append(ArchiveMember(path, name, offset, length, prefix))
+    return members
+
+
+class ArchiveMember:
+    """
+    A file inside a rpa archive. It supports the parts of the interface of pathlib.Path that are
+    used on input files, so it can be decompiled without extracting it. Where a path to it is
+    needed, it acts as the file it would be extracted to: the archive is in the game directory,
+    and names in it are relative to that. Its contents are read from a memory mapping of the
+    archive, which a process shares between all files in it.
+    """
+
+    def __init__(self, archive, name, offset, length, prefix):
+        self.archive = archive
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.prefix = prefix
+        # where this file would be if the archive was extracted
+        self.path = archive.parent / name
+
+    def __str__(self):
+        return f'{self.archive}/{self.name}'
+
+    def __repr__(self):
+        return f'ArchiveMember({str(self)!r})'
+
+    def __eq__(self, other):
+        if not isinstance(other, ArchiveMember):
+            return NotImplemented
+        return self.archive == other.archive and self.name == other.name
+
+    def __hash__(self):
+        return hash((self.archive, self.name))
+
+    @property
+    def suffix(self):
+        return self.path.suffix
+
+    def with_suffix(self, suffix):
+        return self.path.with_suffix(suffix)
+
+    def relative_to(self, other):
+        return self.path.relative_to(other)
+
+    def stat(self):
+        # only the size is ever used of input files
+        return os.stat_result((0, 0, 0, 0, 0, 0, len(self.prefix) + self.length, 0, 0, 0))
+
+    def open(self, mode='rb', buffering=-1):
+        if mode != 'rb':
+            raise ValueError(f"Files in archives can only be opened as 'rb', not {mode!r}")
+
+        view = map_archive(self.archive)
+        contents = view[self.offset:self.offset + self.length]
+        if len(contents) != self.length:
+            raise BadArchiveException(f"{self} extends beyond the end of its archive.")
+        if self.prefix:
+            contents = self.prefix + contents
+        return MemoryReader(contents)
+
+    def read_bytes(self):
+        with self.open() as in_file:
+            return bytes(in_file.view)
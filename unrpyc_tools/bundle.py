@@ -0,0 +1,154 @@
+# Copyright (c) 2012-2024 Yuri K. Schlesner, CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Writing all output into a single file, instead of a file per input. The container formats live
+# in modules that aren't always available (sqlite3 in particular is often missing from minimal
+# python builds), so they are only imported once a bundle of that format is created.
+
+import os
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+
+class OutputBundle:
+    """
+    A single file that all output is written into by the main process, instead of writing a file
+    per input. Entries are named by their path relative to the deepest directory containing all
+    given paths. Line endings are translated like they are when writing output to files, so the
+    entries are the same as the files unrpyc would write on this platform. The bundle is written
+    to a temporary file first, which replaces the file at path once the bundle is closed.
+    Subclasses implement a container format.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = 0
+        self.size = 0
+        self.closed = False
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.',
+                                         suffix=".tmp")
+        os.close(fd)
+        self.temp_path = Path(temp_path)
+
+    @staticmethod
+    def open(path):
+        """Returns a bundle writing to path, in the format indicated by its extension."""
+        name = path.name.lower()
+        if name.endswith(".zip"):
+            return ZipBundle(path)
+        for extension, mode in TarBundle.MODES.items():
+            if name.endswith(extension):
+                return TarBundle(path, mode)
+        if name.endswith((".sqlite", ".sqlite3", ".db")):
+            return SqliteBundle(path)
+        raise ValueError(f"Unknown output bundle format: {path.name}. Supported extensions are "
+                         ".zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, .sqlite, .sqlite3 and .db.")
+
+    def add(self, name, text):
+        """Adds an entry called name containing text."""
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        self.size += self.write(name, text)
+        self.entries += 1
+
+    def close(self):
+        """Finishes writing the bundle and moves it into place."""
+        self.finish()
+        os.replace(self.temp_path, self.path)
+        self.closed = True
+
+    def discard(self):
+        """Deletes the temporary file of a bundle that wasn't closed."""
+        if self.closed:
+            return
+
+        try:
+            self.finish()
+        except Exception:
+            # it's going away anyway, this just makes sure the file isn't open anymore
+            pass
+        self.temp_path.unlink(missing_ok=True)
+        self.closed = True
+
+    def write(self, name, text):
+        """Writes an entry to the bundle. Returns the amount of bytes of text written."""
+        raise NotImplementedError()
+
+    def finish(self):
+        raise NotImplementedError()
+
+
+class TarBundle(OutputBundle):
+    # file extensions and the matching tarfile modes
+    MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2",
+             ".tar.xz": "w:xz"}
+
+    def __init__(self, path, mode):
+        import tarfile
+        super().__init__(path)
+        self.archive = tarfile.open(self.temp_path, mode)
+
+    def write(self, name, text):
+        import tarfile
+        data = text.encode('utf-8')
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.archive.addfile(info, BytesIO(data))
+        return len(data)
+
+    def finish(self):
+        self.archive.close()
+
+
+class ZipBundle(OutputBundle):
+    def __init__(self, path):
+        import zipfile
+        super().__init__(path)
+        self.archive = zipfile.ZipFile(self.temp_path, "w", zipfile.ZIP_DEFLATED)
+
+    def write(self, name, text):
+        data = text.encode('utf-8')
+        self.archive.writestr(name, data)
+        return len(data)
+
+    def finish(self):
+        self.archive.close()
+
+
+class SqliteBundle(OutputBundle):
+    """Stores entries in a table called files, with columns name and content (as text)."""
+
+    def __init__(self, path):
+        import sqlite3
+        super().__init__(path)
+        self.connection = sqlite3.connect(self.temp_path)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("CREATE TABLE files (name TEXT PRIMARY KEY, content TEXT)")
+
+    def write(self, name, text):
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (name, text))
+        return len(text.encode('utf-8'))
+
+    def finish(self):
+        self.connection.commit()
+        self.connection.close()
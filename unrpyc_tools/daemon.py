@@ -0,0 +1,161 @@
+# Copyright (c) 2012-2024 Yuri K. Schlesner, CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# The socket server of the daemon started with `unrpyc.py --serve path/to/socket`. It accepts
+# requests as described in daemon_protocol.py, and hands the files in them to the worker pool of
+# unrpyc.py. That pool and the function that finds the script files in a path are passed in, so
+# this doesn't have to import unrpyc.py itself.
+
+import socket
+import socketserver
+import time
+import traceback
+from pathlib import Path
+
+from .daemon_protocol import ProtocolError, recv_message, send_message
+
+
+def claim_socket(socket_path):
+    """
+    Checks if a daemon can listen at socket_path. A socket left behind by a daemon that didn't
+    exit cleanly is removed. Returns False after explaining why it can't.
+    """
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        print("Unix sockets are not available on this platform, so unrpyc can't run as a daemon.")
+        return False
+
+    if socket_path.exists():
+        # if nothing is listening on it, it was left behind by a daemon that didn't exit cleanly
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(socket_path))
+            except OSError:
+                socket_path.unlink()
+            else:
+                print(f"Another daemon is already listening on {socket_path}.")
+                return False
+
+    return True
+
+
+class RequestError(Exception):
+    """Exception raised when a request can't be handled. The client is told why."""
+    pass
+
+
+class DaemonHandler(socketserver.BaseRequestHandler):
+    """
+    Handles a single request to the daemon. Every request gets a response, if it can't be
+    handled, that is an object with an "error" key explaining why.
+    """
+
+    def handle(self):
+        start = time.perf_counter()
+        self.stop_server = False
+        try:
+            message, payload = recv_message(self.request)
+            response = self.respond(message, payload)
+        except (ProtocolError, RequestError) as e:
+            response = {"error": str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            response = {"error": f"Internal error: {e}"}
+
+        try:
+            send_message(self.request, response)
+        except OSError:
+            # the client is gone, so there's nobody left to tell
+            pass
+
+        if "error" in response:
+            print(f"Refused a request: {response['error']}")
+        elif "results" in response:
+            count = len(response["results"])
+            print(f"Decompiled {count} file{'' if count == 1 else 's'} in "
+                  f"{1000 * (time.perf_counter() - start):.1f} ms.")
+
+        if self.stop_server:
+            self.server.shutdown()
+
+    def respond(self, message, payload):
+        """Handles the request message with its payload, and returns the response."""
+        command = message.get("command")
+
+        if command == "ping":
+            return {"ok": True}
+
+        if command == "shutdown":
+            self.stop_server = True
+            return {"ok": True}
+
+        if command == "decompile":
+            paths = message.get("paths", [])
+            if not isinstance(paths, list) or not all(isinstance(x, str) for x in paths):
+                raise RequestError('"paths" has to be a list of strings')
+            for key in ("overwrite", "write"):
+                if not isinstance(message.get(key, False), bool):
+                    raise RequestError(f'"{key}" has to be true or false')
+
+            for path in paths:
+                if not Path(path).exists():
+                    raise RequestError(f"Path not found: {path}")
+
+            files = self.server.find_files([Path(x) for x in paths])
+            overwrite = message.get("overwrite", False)
+            write = message.get("write", True)
+            tasks = [("path", x, overwrite, write) for x in files]
+
+        elif command == "decompile_bytes":
+            name = message.get("name", "<bytes>")
+            if not isinstance(name, str):
+                raise RequestError('"name" has to be a string')
+            files = [name]
+            tasks = [("bytes", name, payload)]
+
+        elif command is None:
+            raise RequestError('The request has no "command"')
+
+        else:
+            raise RequestError(f"Unknown command {command!r}")
+
+        results = []
+        for path, context in zip(files, self.server.run_tasks(tasks)):
+            results.append({"name": str(path), "state": context.state,
+                            "log": context.log_contents, "output": context.value})
+        return {"results": results}
+
+
+def serve(socket_path, run_tasks, find_files):
+    """
+    Listens on the unix socket at socket_path until interrupted or asked to shut down, after
+    claim_socket said that's possible. run_tasks is called with a list of tasks for the worker of
+    the daemon in unrpyc.py, and returns their contexts in the same order. find_files returns the
+    script files found at a list of paths, like find_script_files in unrpyc.py.
+    """
+    with socketserver.ThreadingUnixStreamServer(str(socket_path), DaemonHandler) as server:
+        server.daemon_threads = True
+        server.run_tasks = run_tasks
+        server.find_files = find_files
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink()
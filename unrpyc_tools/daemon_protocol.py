@@ -0,0 +1,108 @@
+# Copyright (c) 2012-2024 Yuri K. Schlesner, CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+The protocol spoken between the daemon started with `unrpyc.py --serve path/to/socket` and its
+clients, like unrpyc_client.py. This only uses the standard library, so clients don't have to
+import the decompiler.
+
+The daemon is talked to over a unix socket. Every connection carries a single request and its
+response. Both are messages: a 4 byte big endian length followed by that many bytes of a JSON
+object. If the object has a "payload" key, that many bytes of binary data follow the message.
+Requests have a "command" key, one of:
+
+* "decompile": decompiles the files at the absolute paths in "paths", which can also be
+  directories or .rpa archives. The output is written next to the input, unless "write" is
+  false. Existing output is only overwritten if "overwrite" is true.
+* "decompile_bytes": decompiles the contents of a rpyc file sent as the payload, called "name".
+* "ping": checks if the daemon is running.
+* "shutdown": stops the daemon.
+
+The response to decompiling has a "results" key, with an object for every file that has its
+"name", the "state" it ended in (see Context in unrpyc.py), its "log" as a list of lines and the
+"output", unless it was written to a file. A request that can't be handled gets a response with
+an "error" key explaining why instead.
+
+Requests of more than MAX_MESSAGE_SIZE bytes, or with a payload of more than MAX_PAYLOAD_SIZE
+bytes, are refused.
+"""
+
+import json
+import struct
+
+
+# The limits on the size of a message and its payload when receiving one. A request only holds
+# some paths, but responses can hold the output of many files, so they're allowed to be larger.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+MAX_RESPONSE_SIZE = 1024 * 1024 * 1024
+MAX_PAYLOAD_SIZE = 256 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """Exception raised when a message received doesn't follow the protocol"""
+    pass
+
+
+def send_message(sock, message, payload=b""):
+    """Sends the message `message`, which is JSON serializable, followed by `payload`."""
+    if payload:
+        message = dict(message, payload=len(payload))
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(data)) + data)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed in the middle of a message")
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock, max_size=MAX_MESSAGE_SIZE, max_payload=MAX_PAYLOAD_SIZE):
+    """
+    Receives a message. Returns a tuple of the message and its payload. Raises ProtocolError if
+    the message isn't a JSON object, or if it or its payload is larger than allowed.
+    """
+    size, = struct.unpack(">I", recv_exactly(sock, 4))
+    if size > max_size:
+        raise ProtocolError(f"Message of {size} bytes is larger than the limit of {max_size}")
+
+    try:
+        message = json.loads(recv_exactly(sock, size).decode("utf-8"))
+    except ValueError as e:
+        raise ProtocolError(f"Message is not valid JSON: {e}") from None
+    if not isinstance(message, dict):
+        raise ProtocolError("Message is not a JSON object")
+
+    size = message.get("payload", 0)
+    if type(size) is not int or size < 0:
+        raise ProtocolError(f"Payload size {size!r} is not a non-negative integer")
+    if size > max_payload:
+        raise ProtocolError(f"Payload of {size} bytes is larger than the limit of {max_payload}")
+
+    payload = b""
+    if size:
+        payload = recv_exactly(sock, size)
+    return message, payload